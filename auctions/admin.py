@@ -1,14 +1,110 @@
+""" admin for tables that grow to millions of rows
+
+Every changelist loads the rows it shows with their foreign keys in the same
+query, orders by the primary key, only filters and searches on indexed
+columns, and edits foreign keys as raw ids rather than drop downs of every
+row. Counting is what makes huge changelists time out, so the paginator takes
+the database's estimate for an unfiltered table and stops counting a filtered
+one at COUNT_LIMIT rows.
+"""
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.contrib.auth.admin import UserAdmin as AuthUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
 from .models import User, Listing, Bid, Category, Comment
-# Register your models here.
+
+# tables estimated to have more rows than this aren't counted exactly
+ESTIMATE_THRESHOLD = 100000
+
+# most rows counted for a filtered changelist, the last page shown is the one
+# this row is on
+COUNT_LIMIT = 100000
+
+
+def estimate_rows(model, using):
+    """ a cheap guess at how many rows a table has. PostgreSQL keeps one in
+    its statistics, elsewhere the highest id is one that deletions only make
+    too high"""
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [model._meta.db_table])
+            row = cursor.fetchone()
+        # a table that has never been analyzed has no estimate
+        if row and row[0] > 0:
+            return row[0]
+        return None
+    return model._default_manager.using(using).aggregate(highest=Max("pk"))["highest"] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+                return estimate
+        # counting a slice stops at its end
+        return queryset.order_by()[:COUNT_LIMIT].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # the unfiltered total next to a filtered count would be another count
+    show_full_result_count = False
+    ordering = ("-id",)
+
+    def get_search_fields(self, request):
+        # ids can only be looked up by a number, anything else is an error
+        fields = super().get_search_fields(request)
+        if not request.GET.get(SEARCH_VAR, "").strip().isdigit():
+            fields = [field for field in fields if not field.endswith("id")]
+        return fields
+
+
+@admin.register(User)
+class UserAdmin(AuthUserAdmin, LargeTableAdmin):
+    list_display = ("id", "username", "email", "is_staff", "date_joined")
+    list_filter = ()
+    search_fields = ("=username",)
+    ordering = ("-id",)
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ("name", "activeCount")
+    search_fields = ("name",)
+    ordering = ("name",)
 
 
-admin.site.register(User)
+@admin.register(Listing)
+class ListingAdmin(LargeTableAdmin):
+    list_display = ("id", "title", "seller", "category", "currentPrice", "bidCount", "isActive", "endsAt")
+    list_select_related = ("seller", "category")
+    list_filter = ("isActive",)
+    search_fields = ("=id", "=seller__username")
+    raw_id_fields = ("seller",)
+    autocomplete_fields = ("category",)
 
-admin.site.register(Listing)
 
-admin.site.register(Category)
+@admin.register(Bid)
+class BidAdmin(LargeTableAdmin):
+    list_display = ("id", "amount", "listing", "owner")
+    list_select_related = ("listing", "owner")
+    search_fields = ("=listing__id", "=owner__username")
+    raw_id_fields = ("listing", "owner")
 
-admin.site.register(Comment)
 
-admin.site.register(Bid)
\ No newline at end of file
+@admin.register(Comment)
+class CommentAdmin(LargeTableAdmin):
+    list_display = ("id", "listing", "commenter", "comment")
+    list_select_related = ("listing", "commenter")
+    search_fields = ("=listing__id", "=commenter__username")
+    raw_id_fields = ("listing", "commenter")
@@ -0,0 +1,176 @@
+""" read only json api, version 1
+
+Responses are built from values() projections rather than model instances and
+carry a strong ETag computed from the same rows, so a client sending it back
+in If-None-Match gets a 304 before anything is serialized. The bid history
+ETag comes from the listing row alone: every bid changes the listing's bid
+count, so the bids themselves are only read when they have changed. Bid
+histories can also be exported whole with ?format=csv or ?format=jsonl, see
+bid_history.py.
+
+The views are async, their queries run in a thread through sync_to_async.
+"""
+import functools
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags
+
+from . import bid_history
+from .models import Category, Comment, Listing, User
+from .pagination import (InvalidCursor, amount_keyset_page, format_amount_cursor, get_amount_cursor,
+    get_cursor, keyset_page)
+
+LISTING_FIELDS = ("id", "title", "description", "initialPrice", "currentPrice", "bidCount",
+    "isActive", "endsAt", "imageUrl", "category")
+
+LISTING_DETAIL_FIELDS = LISTING_FIELDS + ("seller__username", "leadingBidder__username", "winner__username")
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def require_get(view):
+    """ require_GET for async views, which django's decorators don't wrap"""
+    @functools.wraps(view)
+    async def inner(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return HttpResponseNotAllowed(["GET", "HEAD"])
+        return await view(request, *args, **kwargs)
+    return inner
+
+
+async def conditional_json(request, etag, build):
+    """ answers with a 304 if the client already has etag, otherwise with the
+    json of whatever build returns, build runs in a thread"""
+    if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+    # the weak comparison, proxies that compress a response weaken its etag
+    if etag in (tag[2:] if tag.startswith("W/") else tag for tag in if_none_match) or "*" in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(await sync_to_async(build)())
+    response["ETag"] = etag
+    return response
+
+
+def error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+def unknown_format(format):
+    return error(f"unknown format {format}, use one of {', '.join(bid_history.EXPORT_FORMATS)}", 400)
+
+
+def listing_json(row):
+    """ renames the projected foreign keys of a listing row for the api"""
+    row = dict(row)
+    row["category"] = row.pop("category_id", row.get("category"))
+    for field in ("seller", "leadingBidder", "winner"):
+        if f"{field}__username" in row:
+            row[field] = row.pop(f"{field}__username")
+    return row
+
+
+@require_get
+async def listings(request):
+    """ active listings newest first, a page at a time, optionally in one category"""
+    rows = Listing.objects.filter(isActive=True)
+    category = request.GET.get("category")
+    if category:
+        rows = rows.filter(category=category)
+
+    try:
+        page, next_cursor = await sync_to_async(keyset_page)(rows.values(*LISTING_FIELDS), get_cursor(request))
+    except InvalidCursor as cursor:
+        return error(f"the cursor {cursor} is not valid", 400)
+
+    etag = make_etag([tuple(row.values()) for row in page], next_cursor)
+    return await conditional_json(request, etag, lambda: {
+        "listings": [listing_json(row) for row in page], "next_cursor": next_cursor})
+
+
+@require_get
+async def listing(request, listing_id):
+    row = await sync_to_async(Listing.objects.filter(pk=listing_id).values(*LISTING_DETAIL_FIELDS).first)()
+    if row is None:
+        return error("listing does not exist", 404)
+
+    return await conditional_json(request, make_etag(tuple(row.values())), lambda: listing_json(row))
+
+
+@require_get
+async def listing_bids(request, listing_id):
+    """ the bids on a listing, highest and so newest first, a page at a time or
+    exported whole"""
+    state = await sync_to_async(Listing.objects.filter(pk=listing_id).values_list("bidCount", "leadingBid").first)()
+    if state is None:
+        return error("listing does not exist", 404)
+
+    format = request.GET.get("format")
+    if format is not None:
+        if format not in bid_history.EXPORT_FORMATS:
+            return unknown_format(format)
+        return bid_history.export_listing_bids(listing_id, format)
+
+    try:
+        cursor = get_amount_cursor(request)
+    except InvalidCursor as cursor:
+        return error(f"the cursor {cursor} is not valid", 400)
+
+    def build():
+        page, next_cursor = amount_keyset_page(bid_history.listing_bids(listing_id), cursor)
+        return {"bids": [bid_history.bid_json(bid) for bid in page], "next_cursor": format_amount_cursor(next_cursor)}
+
+    return await conditional_json(request, make_etag(listing_id, state, cursor), build)
+
+
+@require_get
+async def listing_comments(request, listing_id):
+    """ the comments on a listing, newest first, a page at a time"""
+    try:
+        cursor = get_cursor(request)
+    except InvalidCursor as cursor:
+        return error(f"the cursor {cursor} is not valid", 400)
+
+    def load():
+        page, next_cursor = Comment.page(listing_id, cursor)
+        # only a listing without comments needs checking for
+        if not page and not Listing.objects.filter(pk=listing_id).exists():
+            return None
+        return {"comments": [{"id": comment.id, "commenter": comment.commenter.username,
+            "comment": comment.comment} for comment in page], "next_cursor": next_cursor}
+
+    comments = await sync_to_async(load)()
+    if comments is None:
+        return error("listing does not exist", 404)
+    return JsonResponse(comments)
+
+
+@require_get
+async def user_bids(request, username):
+    """ the bids of a user, newest first, a page at a time or exported whole"""
+    user = await sync_to_async(User.objects.filter(username=username).only("id", "username").first)()
+    if user is None:
+        return error("user does not exist", 404)
+
+    format = request.GET.get("format")
+    if format is not None:
+        if format not in bid_history.EXPORT_FORMATS:
+            return unknown_format(format)
+        return bid_history.export_user_bids(user, format)
+
+    try:
+        cursor = get_cursor(request)
+    except InvalidCursor as cursor:
+        return error(f"the cursor {cursor} is not valid", 400)
+
+    page, next_cursor = await sync_to_async(keyset_page)(bid_history.user_bids(user.id), cursor)
+    return JsonResponse({"bids": [bid_history.bid_json(bid) for bid in page], "next_cursor": next_cursor})
+
+
+@require_get
+async def categories(request):
+    names = await sync_to_async(list)(Category.objects.values_list("name", flat=True).order_by("name"))
+    return await conditional_json(request, make_etag(names), lambda: {"categories": names})
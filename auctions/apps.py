@@ -3,3 +3,13 @@ from django.apps import AppConfig
 
 class AuctionsConfig(AppConfig):
     name = 'auctions'
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_migrate
+        from . import checks, db, signals
+
+        post_migrate.connect(signals.search_index_migrated, sender=self)
+        post_migrate.connect(signals.auction_states_migrated, sender=self)
+        connection_created.connect(db.configure_sqlite)
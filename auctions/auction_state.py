@@ -0,0 +1,176 @@
+""" in-process auction state of active listings
+
+AuctionStates keeps, per listing, the fields a bid is checked against: the
+price, whether anyone has bid, the leader, the bid count, whether it is
+active and when it ends. take_bid checks a bid against it before anything
+else, so a bid that is too low or comes after a close is turned away
+without any SQL.
+
+Only what can't be undone by an ordinary edit rules a bid out from memory
+(bidding.rule_out_bid): once a listing has a leader its price only goes up,
+and a close this process recorded stays closed. The end time, the initial
+price and whether a listing read from the database is active can be changed
+either way in the admin, so bids that depend on them go on to the database,
+which decides them as before. Changes that go the other way, such as
+reopening a listing or deleting bids (signals.bid_deleted), drop the
+listing's entry once they are committed, like every other change, in this
+process and through SharedCacheInvalidation in every other. Only committed
+state is kept: entries are updated once a bid or a close commits, and nothing
+read inside a transaction is cached.
+
+Each process has its own states, warmed with the newest active listings when
+a worker starts and bounded by AUCTION_STATE_CACHE_SIZE, the least recently
+used going first. AUCTION_STATE_INVALIDATION names the class that tells
+whether an entry still holds in every process. LocalInvalidation only knows about changes made in
+this process. SharedCacheInvalidation keeps a version per listing in the
+shared cache, one cache read per check, for deployments with several workers.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .caching import get_cache
+from .models import Listing
+
+# what a bid is checked against, see bidding.check_bid
+STATE_FIELDS = ("id", "isActive", "endsAt", "initialPrice", "currentPrice", "leadingBid", "leadingBidder",
+    "bidCount")
+
+
+class LocalInvalidation:
+    """ every entry holds until this process drops it"""
+
+    def versions(self, listing_ids):
+        return {}
+
+    def changed(self, listing_ids):
+        pass
+
+
+class SharedCacheInvalidation:
+    """ a version per listing in AUCTIONS_CACHE, which has to be shared by the
+    processes, replaced whenever the listing changes"""
+
+    def get_cache(self):
+        return get_cache()
+
+    def key(self, listing_id):
+        return f"auction-state-version:{listing_id}"
+
+    def versions(self, listing_ids):
+        found = self.get_cache().get_many([self.key(pk) for pk in listing_ids])
+        return {pk: found.get(self.key(pk)) for pk in listing_ids}
+
+    def changed(self, listing_ids):
+        self.get_cache().set_many({self.key(pk): uuid.uuid4().hex for pk in listing_ids}, None)
+
+
+def snapshot(listing):
+    """ a listing holding only a copy of the state fields of listing"""
+    return Listing(**{field.attname: getattr(listing, field.attname)
+        for field in (Listing._meta.get_field(name) for name in STATE_FIELDS)})
+
+
+def closed_state(listing_id):
+    """ the state of a listing this process has just closed"""
+    listing = Listing(id=listing_id, isActive=False)
+    listing.closedHere = True
+    return listing
+
+
+class AuctionStates:
+    """ a bounded map of listing ids to (version, snapshot)"""
+
+    def __init__(self, size, invalidation):
+        self.size = size
+        self.invalidation = invalidation
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # counts the changes seen, so a load that overlapped one isn't kept
+        self._changes = 0
+
+    def _put(self, entries, changes=None):
+        with self._lock:
+            if changes is not None and changes != self._changes:
+                return
+            for listing_id, entry in entries.items():
+                self._entries[listing_id] = entry
+                self._entries.move_to_end(listing_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def _load(self, listings, versions=None):
+        """ caches the state of the listings of a queryset, returns them by id.
+        versions read before the query make a change during it show as stale"""
+        # a transaction may be reading its own writes, which could still roll back
+        cacheable = not connection.in_atomic_block
+        changes = self._changes
+        listings = list(listings.only(*STATE_FIELDS))
+        if versions is None:
+            versions = self.invalidation.versions([listing.id for listing in listings]) if listings else {}
+        loaded = {listing.id: snapshot(listing) for listing in listings}
+        if cacheable:
+            self._put({pk: (versions.get(pk), listing) for pk, listing in loaded.items()}, changes)
+        return loaded
+
+    def warm(self):
+        """ loads the newest active listings in one query. which ones isn't known
+        before it, so a change in another process during it can go unnoticed"""
+        self._load(Listing.objects.filter(isActive=True).order_by("-id")[:self.size])
+
+    def get(self, listing_id):
+        """ the state of a listing, from memory if it is there and current.
+        none if there is no such listing"""
+        with self._lock:
+            entry = self._entries.get(listing_id)
+            if entry is not None:
+                self._entries.move_to_end(listing_id)
+        versions = self.invalidation.versions([listing_id])
+        if entry is not None and versions.get(listing_id) == entry[0]:
+            return entry[1]
+        return self._load(Listing.objects.filter(pk=listing_id), versions).get(listing_id)
+
+    def changed(self, listing_ids):
+        """ forgets the listings here and, through the invalidation, everywhere else"""
+        self.invalidation.changed(listing_ids)
+        with self._lock:
+            self._changes += 1
+            for listing_id in listing_ids:
+                self._entries.pop(listing_id, None)
+
+    def remember(self, listing):
+        """ keeps the committed state of a listing that was just changed"""
+        version = self.invalidation.versions([listing.id]).get(listing.id)
+        self._put({listing.id: (version, snapshot(listing))})
+
+    def closed(self, listing_ids):
+        """ keeps that the listings were just closed"""
+        versions = self.invalidation.versions(listing_ids)
+        self._put({pk: (versions.get(pk), closed_state(pk)) for pk in listing_ids})
+
+    def clear(self):
+        with self._lock:
+            self._changes += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_states = None
+_states_lock = threading.Lock()
+
+
+def get_states():
+    """ the auction states of this process, gunicorn.conf.py warms them when a
+    worker starts"""
+    global _states
+    with _states_lock:
+        if _states is None:
+            _states = AuctionStates(settings.AUCTION_STATE_CACHE_SIZE,
+                import_string(settings.AUCTION_STATE_INVALIDATION)())
+        return _states
@@ -0,0 +1,193 @@
+""" benchmarks of the auction hot paths
+
+run_scenario drives one view through the Django test client from a number
+of threads, each with its own client and database connection, timing every
+request. The benchmark management command runs the scenarios against a
+throwaway database filled by datagen.generate and writes the results to JSON,
+so runs from before and after a change can be compared.
+"""
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from .datagen import USERNAME_PREFIX
+from .models import Category, Listing, User
+
+
+class Fixture:
+    """ what the scenarios pick their requests from"""
+
+    def __init__(self):
+        self.listings = list(Listing.objects.filter(isActive=True).values_list("id", "title"))
+        self.categories = list(Category.objects.values_list("name", flat=True))
+        self.users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list("id", flat=True))
+        if not (self.listings and self.categories and self.users):
+            raise ValueError("the database has no synthetic data, generate it first")
+
+
+# each scenario turns a random generator and the fixture into the request to
+# time, as (method, path, data). anything they read from the database is read
+# before the clock starts
+
+def index(rng, fixture):
+    return "get", reverse("index"), None
+
+
+def single_listing(rng, fixture):
+    pk, title = rng.choice(fixture.listings)
+    return "get", reverse("single_listing", args=[title]) + f"?id={pk}", None
+
+
+def make_bid(rng, fixture):
+    pk, _ = rng.choice(fixture.listings)
+    price = Listing.objects.filter(pk=pk).values_list("currentPrice", flat=True).first() or Decimal(0)
+    return "post", reverse("make_bid", args=[pk]), {"bid": str(price + Decimal(rng.randint(1, 500)) / 100)}
+
+
+def low_bid(rng, fixture):
+    # under every start price, so always turned away
+    pk, _ = rng.choice(fixture.listings)
+    return "post", reverse("make_bid", args=[pk]), {"bid": "0.01"}
+
+
+def category_listings(rng, fixture):
+    return "get", reverse("category_listings", args=[rng.choice(fixture.categories)]), None
+
+
+def watchlist(rng, fixture):
+    return "get", reverse("show_watchlist"), None
+
+
+# scenarios that bid, where only a redirect means the bid was taken. a rejected
+# or undecided bid renders errors.html with a 200
+BID_SCENARIOS = {"make_bid", "low_bid"}
+
+SCENARIOS = {
+    "index": index,
+    "single_listing": single_listing,
+    "make_bid": make_bid,
+    "low_bid": low_bid,
+    "category_listings": category_listings,
+    "watchlist": watchlist,
+}
+
+
+def percentile(ordered, fraction):
+    """ nearest rank percentile of an ordered list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+@dataclass
+class Result:
+    scenario: str
+    concurrency: int
+    seconds: float = 0.0
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    # bids answered without an error but not taken, only counted for BID_SCENARIOS
+    rejected: int = 0
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        milliseconds = lambda value: None if value is None else round(value * 1000, 3)
+        summary = {
+            "requests": len(ordered),
+            "errors": self.errors,
+            "concurrency": self.concurrency,
+            "throughput": round(len(ordered) / self.seconds, 2) if self.seconds else None,
+            "mean_ms": milliseconds(sum(ordered) / len(ordered)) if ordered else None,
+            "p50_ms": milliseconds(percentile(ordered, 0.50)),
+            "p90_ms": milliseconds(percentile(ordered, 0.90)),
+            "p99_ms": milliseconds(percentile(ordered, 0.99)),
+            "max_ms": milliseconds(ordered[-1] if ordered else None),
+        }
+        if self.scenario in BID_SCENARIOS:
+            accepted = len(ordered) - self.errors - self.rejected
+            summary.update(accepted=accepted, rejected=self.rejected,
+                accepted_throughput=round(accepted / self.seconds, 2) if self.seconds else None)
+        return summary
+
+
+def _client():
+    """ a test client that passes ALLOWED_HOSTS outside of the test runner and
+    turns exceptions into 500s, counted as errors, like a real server would"""
+    hosts = [host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"]
+    return Client(raise_request_exception=False, SERVER_NAME=hosts[0] if hosts else "localhost")
+
+
+def _worker(name, fixture, requests, warmup, rng, result, lock, warmed_up):
+    scenario, bids = SCENARIOS[name], name in BID_SCENARIOS
+    client = _client()
+    client.force_login(User.objects.get(pk=rng.choice(fixture.users)))
+    for _ in range(warmup):
+        method, path, data = scenario(rng, fixture)
+        getattr(client, method)(path, data)
+    warmed_up()
+
+    latencies, errors, rejected = [], 0, 0
+    for _ in range(requests):
+        method, path, data = scenario(rng, fixture)
+        start = time.perf_counter()
+        response = getattr(client, method)(path, data)
+        latencies.append(time.perf_counter() - start)
+        errors += response.status_code >= 400
+        rejected += bids and response.status_code < 400 and response.status_code != 302
+
+    with lock:
+        result.latencies += latencies
+        result.errors += errors
+        result.rejected += rejected
+
+
+def run_scenario(name, fixture, requests=1000, concurrency=1, warmup=10, random_seed=0):
+    """ times requests requests of a scenario spread over concurrency threads,
+    after each has warmed up. a concurrency of one runs in the calling thread"""
+    result = Result(scenario=name, concurrency=concurrency)
+    lock = threading.Lock()
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    rngs = [random.Random(f"{random_seed}:{name}:{i}") for i in range(concurrency)]
+    start = None
+
+    if concurrency == 1:
+        def started():
+            nonlocal start
+            start = time.perf_counter()
+        _worker(name, fixture, shares[0], warmup, rngs[0], result, lock, started)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    # the clock starts once every thread has warmed up
+    barrier = threading.Barrier(concurrency + 1)
+
+    def work(share, rng):
+        try:
+            _worker(name, fixture, share, warmup, rng, result, lock, barrier.wait)
+        except threading.BrokenBarrierError:
+            pass
+        except BaseException:
+            barrier.abort()
+            raise
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=work, args=(share, rng)) for share, rng in zip(shares, rngs)]
+    for thread in threads:
+        thread.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    result.seconds = time.perf_counter() - start
+    return result
@@ -0,0 +1,127 @@
+""" bid histories
+
+A listing's bids are read highest first, which for the bids a listing takes
+is also newest first, and a user's newest first, a page at a time with the
+keyset pagination in pagination.py. export streams a whole history as CSV or
+JSON lines, reading it a chunk of rows at a time in the same way, so however
+long the history only one chunk is ever held in memory.
+
+Django 3.2 iterates a streaming response on the event loop under ASGI, where
+queries aren't allowed, so there streams.ASGIHandler sends an ExportResponse
+through its async iteration instead, which awaits each chunk from Django's
+database thread. The loop goes on serving other requests in the meantime.
+"""
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import Bid
+from .pagination import amount_keyset_page, keyset_page
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+# rows read by each query of an export
+EXPORT_CHUNK_SIZE = 1000
+
+
+def listing_bids(listing_id):
+    """ the bids on a listing as rows, walked with amount_keyset_page"""
+    return Bid.objects.filter(listing=listing_id).values("id", "amount", "owner__username")
+
+
+def user_bids(user_id):
+    """ the bids of a user as rows, walked with keyset_page"""
+    return Bid.objects.filter(owner=user_id).values("id", "amount", "listing", "listing__title")
+
+
+def bid_json(row):
+    """ renames the projected foreign keys of a bid row for the api"""
+    row = dict(row)
+    if "owner__username" in row:
+        row["owner"] = row.pop("owner__username")
+    if "listing__title" in row:
+        row["listing_title"] = row.pop("listing__title")
+    return row
+
+
+def walk(paginate, queryset, chunk_size=None):
+    """ yields every row of queryset, reading it a page of chunk_size at a time"""
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    cursor = None
+    while True:
+        page, cursor = paginate(queryset, cursor, chunk_size)
+        yield from page
+        if cursor is None:
+            return
+
+
+async def walk_async(paginate, queryset, chunk_size=None):
+    """ walk for the event loop, each page is read on django's database thread"""
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    cursor = None
+    while True:
+        page, cursor = await sync_to_async(paginate)(queryset, cursor, chunk_size)
+        for row in page:
+            yield row
+        if cursor is None:
+            return
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+class ExportResponse(StreamingHttpResponse):
+    """ streams every row of queryset in format, one of EXPORT_FORMATS. header
+    names the columns of a csv export"""
+
+    def __init__(self, paginate, queryset, format, header):
+        self.paginate, self.queryset, self.format, self.header = paginate, queryset, format, header
+        super().__init__(self.lines(), content_type=EXPORT_FORMATS[format])
+
+    def first_lines(self):
+        return [_csv_line(self.header)] if self.format == "csv" else []
+
+    def line(self, row):
+        row = bid_json(row)
+        if self.format == "csv":
+            return _csv_line([row[name] for name in self.header])
+        return json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+    def lines(self):
+        yield from self.first_lines()
+        for row in walk(self.paginate, self.queryset):
+            yield self.line(row)
+
+    async def async_content(self):
+        """ the streamed content as bytes, for iterating on the event loop"""
+        for line in self.first_lines():
+            yield self.make_bytes(line)
+        async for row in walk_async(self.paginate, self.queryset):
+            yield self.make_bytes(self.line(row))
+
+
+def export(paginate, queryset, format, filename, header):
+    """ a response streaming every row of queryset in format"""
+    response = ExportResponse(paginate, queryset, format, header)
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{format}"'
+    return response
+
+
+def export_listing_bids(listing_id, format):
+    return export(amount_keyset_page, listing_bids(listing_id), format, f"listing-{listing_id}-bids",
+        ["id", "amount", "owner"])
+
+
+def export_user_bids(user, format):
+    return export(keyset_page, user_bids(user.id), format, f"{user.username}-bids",
+        ["id", "amount", "listing", "listing_title"])
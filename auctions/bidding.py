@@ -0,0 +1,154 @@
+""" placing bids and closing listings
+
+A bid is validated and recorded in one transaction. The listing row is locked
+while the bid is checked and the stored price only moves through the
+conditional update in Listing.recordBid, so two bidders racing for the same
+price can never both win it.
+
+SQLite has no row locks and ignores select_for_update. A transaction that has
+read and then wants to write can't wait for another writer, because its reads
+may be stale by then, and fails with "database is locked" straight away. So
+on SQLite a bid writes first, which takes the database's write lock before
+anything is read and lets it wait out the busy timeout like any other write.
+Whatever lock errors remain are retried with a backoff.
+"""
+import random
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import category_counts
+from .auction_state import get_states
+from .models import Bid, Listing
+from .signals import listing_changed
+
+
+class BidRejected(Exception):
+    """ raised when a bid can't be placed, the message can be shown to the bidder"""
+
+
+class BidUndecided(BidRejected):
+    """ raised when whether a bid was placed isn't known yet, it may still be"""
+
+
+def retry_when_locked(func):
+    """ reruns a write that failed because the database was locked, backing
+    off a little longer each time"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = getattr(settings, "BID_RETRY_ATTEMPTS", 5)
+        backoff = getattr(settings, "BID_RETRY_BACKOFF", 0.01)
+
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if "locked" not in str(error) or attempt == attempts - 1:
+                    raise
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def check_bid(listing, amount):
+    """ raises BidRejected unless listing, as loaded, takes a bid of amount"""
+    if not listing.isActive:
+        raise BidRejected("this listing is closed and no longer takes bids")
+    # the scheduler may not have got round to closing it yet
+    if listing.hasEnded():
+        raise BidRejected("this auction has ended")
+    if not listing.isValidBid(amount):
+        raise BidRejected(" your bid is not valid, it's too small")
+
+
+def rule_out_bid(state, amount):
+    """ raises BidRejected if a bid of amount can't be taken however much the
+    cached state of its listing is out of date, see auction_state.py"""
+    if getattr(state, "closedHere", False):
+        raise BidRejected("this listing is closed and no longer takes bids")
+    if state.leadingBid_id is not None and not state.isValidBid(amount):
+        raise BidRejected(" your bid is not valid, it's too small")
+
+
+def lock_for_writing(listing_ids):
+    """ on file sqlite, takes the write lock before anything is read"""
+    # in memory databases lock per table and never wait, so this only helps files
+    if connection.vendor == "sqlite" and not connection.is_in_memory_db():
+        # a write that changes nothing
+        Listing.objects.filter(pk__in=listing_ids).update(bidCount=F("bidCount"))
+
+
+@retry_when_locked
+def place_bid(listing_id, user, amount):
+    """ records a bid of amount by user if it beats the current price, returns
+    the new bid or raises BidRejected"""
+    with transaction.atomic():
+        lock_for_writing([listing_id])
+        try:
+            listing = Listing.objects.select_for_update().get(pk=listing_id)
+        except Listing.DoesNotExist:
+            raise BidRejected("error: listing_id not valid")
+
+        check_bid(listing, amount)
+        bid = Bid.objects.create(amount=amount, listing=listing, owner=user)
+
+        # recordBid only hands over the lead if the stored price is still lower,
+        # when another bid got there first raising here rolls ours back
+        if listing.leadingBid_id != bid.pk:
+            raise BidRejected(" your bid is not valid, it's too small")
+        transaction.on_commit(lambda: get_states().remember(listing))
+        return bid
+
+
+@retry_when_locked
+def refresh_bid_stats(listing_id):
+    """ repairs the stored auction state of a listing from its bids while it is
+    locked against new ones, returns true if anything had drifted"""
+    with transaction.atomic():
+        lock_for_writing([listing_id])
+        listing = Listing.objects.select_for_update().filter(pk=listing_id).first()
+        return listing is not None and listing.refreshBidStats()
+
+
+def close_listings(listing_ids):
+    """ closes whichever of the listings are still active in one update, making
+    each one's leading bidder its winner. returns how many were closed"""
+    listing_ids = list(listing_ids)
+    with transaction.atomic():
+        active = dict(Listing.objects.filter(pk__in=listing_ids, isActive=True).values_list("pk", "category"))
+        # a single conditional update waits for any bid holding a row lock
+        closed = Listing.objects.filter(pk__in=active, isActive=True).update(
+            isActive=False, winner=F("leadingBidder"))
+        if closed:
+            listing_changed(*listing_ids)
+            transaction.on_commit(lambda: get_states().closed(list(active)))
+        if closed and closed == len(active):
+            category_counts.adjust({name: -count for name, count in Counter(active.values()).items()})
+        elif closed != len(active):
+            # someone else closed some of them in between, so which were closed
+            # here isn't known
+            category_counts.reconcile(set(active.values()))
+    return closed
+
+
+@retry_when_locked
+def close_listing(listing_id, seller):
+    """ stops a listing owned by seller from taking bids, returns false if the
+    listing doesn't exist or belongs to someone else"""
+    with transaction.atomic():
+        if not Listing.objects.filter(pk=listing_id, seller=seller).exists():
+            return False
+        close_listings([listing_id])
+        return True
+
+
+@retry_when_locked
+def close_due_auctions(now=None, batch_size=500):
+    """ closes up to batch_size listings whose end time has passed, the ones
+    that ended first go first. returns how many were closed"""
+    due = Listing.objects.filter(isActive=True, endsAt__lte=now or timezone.now()).order_by("endsAt")
+    return close_listings(due.values_list("pk", flat=True)[:batch_size])
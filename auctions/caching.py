@@ -0,0 +1,12 @@
+""" the cache the auctions app keeps its data in
+
+Rendered listing cards, the category counts and the auction state versions all
+go in the cache named by AUCTIONS_CACHE. Their invalidations only reach other
+processes when it is shared between them.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+
+def get_cache():
+    return caches[getattr(settings, "AUCTIONS_CACHE", "default")]
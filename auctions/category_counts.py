@@ -0,0 +1,55 @@
+""" active listing counts per category
+
+Every category row keeps the number of its listings that are active
+(Category.activeCount). Creating, closing and deleting a listing adjust it in
+the same transaction, so the categories page reads names and counts in one
+query instead of counting listings, and caches that query's rows until a
+count changes. Changes made some other way, such as moving a listing to
+another category in the admin, aren't counted. The reconcile_category_counts
+command recounts from the listings table and can run periodically to repair
+that drift.
+"""
+from django.db import transaction
+
+from .caching import get_cache
+from .models import Category
+
+CACHE_KEY = "category-counts"
+
+# seconds the rows are cached. invalidating only reaches the cache of this
+# process when each worker has its own, so this bounds how stale others get
+TIMEOUT = 60
+
+
+def invalidate():
+    """ drops the cached rows now and again once the change is committed, so a
+    read of the old counts in between can't stay cached"""
+    get_cache().delete(CACHE_KEY)
+    transaction.on_commit(lambda: get_cache().delete(CACHE_KEY))
+
+
+def adjust(deltas):
+    """ adds a dict of category names to deltas to their active counts"""
+    Category.adjustActiveCounts(deltas)
+    invalidate()
+
+
+def category_counts(popular=False):
+    """ (name, active count) of every category by name, or most active first"""
+    cache = get_cache()
+    rows = cache.get(CACHE_KEY)
+    if rows is None:
+        rows = list(Category.objects.order_by("name").values_list("name", "activeCount"))
+        cache.set(CACHE_KEY, rows, TIMEOUT)
+
+    if popular:
+        # sorted is stable, so equal counts stay in name order
+        return sorted(rows, key=lambda row: -row[1])
+    return rows
+
+
+def reconcile(names=None):
+    """ recounts the active listings of the categories, returns how many had drifted"""
+    drifted = Category.recountActive(names)
+    invalidate()
+    return drifted
@@ -0,0 +1,44 @@
+""" system checks for settings that only go wrong with several processes"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# caches each process keeps to itself
+PROCESS_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+CACHED_SESSION_ENGINES = (
+    "django.contrib.sessions.backends.cache",
+    "django.contrib.sessions.backends.cached_db",
+)
+
+
+@register(Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    """ sessions cached per process outlive logging out in every other process"""
+    if settings.SESSION_ENGINE not in CACHED_SESSION_ENGINES:
+        return []
+    backend = settings.CACHES.get(settings.SESSION_CACHE_ALIAS, {}).get("BACKEND")
+    if backend not in PROCESS_CACHES:
+        return []
+    return [Error(
+        f"{settings.SESSION_ENGINE} keeps sessions in {backend}, which every process has its own of",
+        hint="set CACHE_BACKEND to a cache the processes share, or use the db session engine",
+        id="auctions.E001",
+    )]
+
+
+@register(Tags.caches)
+def check_state_invalidation(app_configs, **kwargs):
+    """ versions kept per process can't tell one process of another's changes"""
+    if settings.AUCTION_STATE_INVALIDATION != "auctions.auction_state.SharedCacheInvalidation":
+        return []
+    backend = settings.CACHES.get(settings.AUCTIONS_CACHE, {}).get("BACKEND")
+    if backend not in PROCESS_CACHES:
+        return []
+    return [Error(
+        f"SharedCacheInvalidation keeps its versions in {backend}, which every process has its own of",
+        hint="set CACHE_BACKEND, or AUCTIONS_CACHE, to a cache the processes share",
+        id="auctions.E002",
+    )]
@@ -0,0 +1,187 @@
+""" synthetic auction data
+
+generate writes a data set shaped like a live site straight into the auction
+tables. Bids and comments per listing follow a power law, so most listings get
+a handful and a few get thousands, and a few users, sellers and categories
+account for most of the activity. Everything comes from one seeded random
+generator, so the same seed and volumes give the same rows.
+
+Listings are built a chunk at a time along with their bids and comments, each
+chunk in one transaction. Ids are handed out up front so a listing can point
+at its leading bid before the bid is inserted. Listings go in through
+bulk_create, but bids and comments, which are most of the rows, are inserted
+as plain tuples with executemany: building model instances and compiling
+bulk_create's sql took most of the time otherwise. The search index triggers
+are dropped for the load and the index rebuilt once at the end, and the
+category counts are recounted once too. The explicit ids leave PostgreSQL's
+sequences behind, so they are moved past them at the end.
+"""
+import itertools
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from . import category_counts, search
+from .models import Bid, Category, Comment, Listing, User, WatchlistEntry
+
+USERNAME_PREFIX = "synthetic"
+
+# share of the listings still open
+ACTIVE_SHARE = 0.9
+
+# pareto shape of the bids and comments per listing, 1.16 puts 80% of them on
+# 20% of the listings
+ACTIVITY_SHAPE = 1.16
+
+# zipf exponent of how often each user, seller and category comes up
+POPULARITY_EXPONENT = 1.0
+
+WORDS = ("vintage antique brass oak walnut leather silver ceramic glass wool linen copper "
+    "lamp chair table clock radio camera bicycle guitar vase mirror rug desk kettle globe "
+    "restored original rare signed boxed working mint worn handmade small large pair").split()
+
+
+@dataclass
+class Volumes:
+    users: int = 1000
+    categories: int = 100
+    listings: int = 10000
+    bids: int = 100000
+    comments: int = 20000
+    # listings on each user's watchlist
+    watched: int = 20
+
+
+def zipf_weights(n, exponent=POPULARITY_EXPONENT):
+    """ cumulative weights making the kth of n items 1/k**exponent as likely as the first"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+def power_law_counts(total, n, rng, shape=ACTIVITY_SHAPE):
+    """ splits total into n pareto distributed counts that add up to exactly total"""
+    if not n:
+        return []
+    weights = [rng.paretovariate(shape) for _ in range(n)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    # rounding down loses less than one per count
+    for i in rng.sample(range(n), total - sum(counts)):
+        counts[i] += 1
+    return counts
+
+
+def next_id(model):
+    return (model.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1
+
+
+def insert_rows(model, fields, rows):
+    """ inserts tuples of the values of fields as rows of model's table"""
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(model._meta.get_field(name).column) for name in fields)
+    sql = (f"INSERT INTO {quote(model._meta.db_table)} ({columns}) "
+        f"VALUES ({', '.join(['%s'] * len(fields))})")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def reset_sequences(*models):
+    """ moves the id sequences of the models past the ids inserted explicitly,
+    which PostgreSQL doesn't do by itself. nothing to do on SQLite"""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def generate(volumes, random_seed=0, chunk_size=5000, progress=None):
+    """ writes volumes worth of synthetic data, calling progress(table, done,
+    total) after each chunk"""
+    rng = random.Random(random_seed)
+    progress = progress or (lambda table, done, total: None)
+    if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+        raise ValueError("the database already has synthetic users")
+
+    # hashing is slow on purpose, every user gets the same hash
+    password = make_password(USERNAME_PREFIX)
+    for start in range(0, volumes.users, chunk_size):
+        end = min(start + chunk_size, volumes.users)
+        User.objects.bulk_create([User(username=f"{USERNAME_PREFIX}{i}", password=password)
+            for i in range(start, end)])
+        progress("users", end, volumes.users)
+    user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX)
+        .order_by("id").values_list("id", flat=True))
+    user_weights = zipf_weights(len(user_ids))
+
+    categories = [f"category {i}" for i in range(volumes.categories)]
+    Category.objects.bulk_create([Category(name=name) for name in categories], ignore_conflicts=True)
+    category_weights = zipf_weights(len(categories))
+    progress("categories", len(categories), len(categories))
+
+    bid_counts = power_law_counts(volumes.bids, volumes.listings, rng)
+    comment_counts = power_law_counts(volumes.comments, volumes.listings, rng)
+
+    search.drop_triggers()
+    try:
+        listing_id, bid_id = next_id(Listing), next_id(Bid)
+        for start in range(0, volumes.listings, chunk_size):
+            listings, bids, comments = [], [], []
+            for i in range(start, min(start + chunk_size, volumes.listings)):
+                price = Decimal(rng.randint(100, 50000)) / 100
+                listing = Listing(id=listing_id, title=_words(rng, 3), description=_words(rng, 20),
+                    seller_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+                    category_id=rng.choices(categories, cum_weights=category_weights)[0],
+                    initialPrice=price, currentPrice=price, imageUrl=Listing.DEFAULTIMAGEURL,
+                    isActive=rng.random() < ACTIVE_SHARE, bidCount=bid_counts[i])
+
+                for owner_id in rng.choices(user_ids, cum_weights=user_weights, k=bid_counts[i]):
+                    price += Decimal(rng.randint(1, 1000)) / 100
+                    bids.append((bid_id, listing_id, owner_id, price))
+                    bid_id += 1
+                if bid_counts[i]:
+                    leader_id, _, leader_owner_id, leader_amount = bids[-1]
+                    listing.currentPrice = leader_amount
+                    listing.leadingBid_id = leader_id
+                    listing.leadingBidder_id = leader_owner_id
+                    if not listing.isActive:
+                        listing.winner_id = leader_owner_id
+
+                for commenter_id in rng.choices(user_ids, cum_weights=user_weights, k=comment_counts[i]):
+                    comments.append((listing_id, commenter_id, _words(rng, rng.randint(3, 30))))
+
+                listings.append(listing)
+                listing_id += 1
+
+            # the leading bid foreign keys are only checked on commit
+            with transaction.atomic():
+                Listing.objects.bulk_create(listings)
+                insert_rows(Bid, ("id", "listing", "owner", "amount"), bids)
+                insert_rows(Comment, ("listing", "commenter", "comment"), comments)
+            progress("listings", start + len(listings), volumes.listings)
+    finally:
+        reset_sequences(Listing, Bid)
+        search.ensure_index()
+    category_counts.reconcile()
+
+    if volumes.listings:
+        first_listing = listing_id - volumes.listings
+        watched = min(volumes.watched, volumes.listings)
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            WatchlistEntry.objects.bulk_create([WatchlistEntry(user_id=user_id, listing_id=first_listing + offset)
+                for user_id in chunk for offset in rng.sample(range(volumes.listings), watched)])
+            progress("watchlists", start + len(chunk), len(user_ids))
+
+
+def count_volumes():
+    """ the volumes of the synthetic data already in the database"""
+    users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+    return Volumes(users=users.count(), categories=Category.objects.count(),
+        listings=Listing.objects.count(), bids=Bid.objects.count(), comments=Comment.objects.count(),
+        watched=WatchlistEntry.objects.filter(user__in=users.order_by("id")[:1]).count())
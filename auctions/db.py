@@ -0,0 +1,19 @@
+""" database connection setup"""
+import re
+
+from django.conf import settings
+
+PRAGMA_VALUE = re.compile(r"^[\w-]+$")
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """ applies the SQLITE_PRAGMAS setting to each new sqlite connection"""
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+            # pragmas can't take parameters, so only plain words go in
+            if not (PRAGMA_VALUE.match(pragma) and PRAGMA_VALUE.match(str(value))):
+                raise ValueError(f"invalid sqlite pragma {pragma}={value}")
+            cursor.execute(f"PRAGMA {pragma} = {value}")
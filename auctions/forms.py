@@ -1,4 +1,5 @@
-from django.forms import ModelForm
+from django.forms import ModelForm, ValidationError
+from django.utils import timezone
 from auctions.models import Listing
 
 from crispy_forms.helper import FormHelper
@@ -24,5 +25,12 @@ class ListingForm(ModelForm):
 				Column("category", css_class="form-group col-md-3 mb-0"),
 				css_class="form-row"
 			),
+			"endsAt",
 			Submit("submit", "Save and Exit")
-		)
\ No newline at end of file
+		)
+
+	def clean_endsAt(self):
+		endsAt = self.cleaned_data["endsAt"]
+		if endsAt is not None and endsAt <= timezone.now():
+			raise ValidationError("the auction has to end in the future")
+		return endsAt
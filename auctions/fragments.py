@@ -0,0 +1,72 @@
+""" cached listing cards
+
+A rendered card is stored under the listing id and a version token. Saving the
+listing or bidding on it replaces the token (see signals.py), so stale cards
+are never served and are simply left for the cache to evict. Hits and misses
+are counted per process so the hit ratio can be checked under load.
+"""
+import threading
+import uuid
+
+from django.template.loader import render_to_string
+
+from .caching import get_cache
+
+CARD_TEMPLATE = "auctions/_listings.html"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def version_key(listing_id):
+    return f"listing-card-version:{listing_id}"
+
+
+def invalidate(*listing_ids):
+    """ gives the listings a new version so their cached cards are skipped"""
+    get_cache().set_many({version_key(pk): uuid.uuid4().hex for pk in listing_ids}, None)
+
+
+def render_card(listing):
+    """ returns the card html for a listing, rendering it only on a cache miss"""
+    cache = get_cache()
+
+    # a missing version is created here rather than assumed, so a card cached
+    # under an evicted version can't come back
+    version = cache.get(version_key(listing.id))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(version_key(listing.id), version, None):
+            version = cache.get(version_key(listing.id), version)
+
+    key = f"listing-card:{listing.id}:{version}"
+    html = cache.get(key)
+    with _stats_lock:
+        _stats["hits" if html is not None else "misses"] += 1
+
+    if html is None:
+        html = render_to_string(CARD_TEMPLATE, {"listing": listing})
+        cache.set(key, html)
+    return html
+
+
+def render_cards(listings):
+    """ renders the cards of listings ahead of the template, which shows them
+    with the listing_card tag without going to the cache. async views call this
+    in their thread, as a cache can be as blocking as the database"""
+    for listing in listings:
+        listing.cardHtml = render_card(listing)
+    return listings
+
+
+def stats():
+    """ the hit and miss counts of this process"""
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    lookups = hits + misses
+    return {"hits": hits, "misses": misses, "ratio": hits / lookups if lookups else 0.0}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
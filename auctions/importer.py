@@ -0,0 +1,131 @@
+""" bulk listing imports
+
+Rows are read one at a time from a CSV or JSON lines stream, checked with the
+ListingForm rules and inserted with bulk_create a chunk at a time, each chunk
+in its own transaction. Only one chunk is held in memory, so the size of an
+import is bounded by the database rather than the process. Categories named
+by the rows are created as they are first seen.
+"""
+import csv
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+
+from django import forms
+from django.db import transaction
+
+from . import category_counts
+from .forms import ListingForm
+from .models import Category, Listing
+
+FORMATS = ("csv", "jsonl")
+
+
+class ImportListingForm(ListingForm):
+    """ the ListingForm rules for one imported row. the category is taken as a
+    plain name, missing ones are created instead of failing the row"""
+    category = forms.CharField(max_length=50, required=False)
+
+    class Meta(ListingForm.Meta):
+        exclude = ListingForm.Meta.exclude + ["category"]
+
+    def __init__(self, *args, **kwargs):
+        # nothing is rendered, so skip building ListingForm's crispy layout
+        forms.ModelForm.__init__(self, *args, **kwargs)
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    failed: int = 0
+    # (line, message) for the first max_errors rows that failed
+    errors: list = field(default_factory=list)
+    max_errors: int = 1000
+    # why the file stopped being read, the rows before it were imported
+    file_error: str = None
+
+    def reject(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, message))
+
+
+class ImportFileError(ValueError):
+    """ raised while reading rows when the rest of the file can't be read"""
+
+
+def read_rows(stream, format):
+    """ yields (line number, row) from a text stream, row is none for a line
+    that couldn't be parsed. raises ImportFileError if the file isn't utf-8
+    text or not valid csv"""
+    line = 0
+    try:
+        for line, row in _read_rows(stream, format):
+            yield line, row
+    except (UnicodeDecodeError, csv.Error) as error:
+        where = f" after line {line}" if line else ""
+        raise ImportFileError(f"the file can't be read{where}: {error}")
+
+
+def _read_rows(stream, format):
+    if format == "csv":
+        # the header is line 1
+        for line, row in enumerate(csv.DictReader(stream), start=2):
+            yield line, row
+    elif format == "jsonl":
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError:
+                row = None
+            yield line, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"unknown import format {format}, use one of {', '.join(FORMATS)}")
+
+
+def import_listings(rows, seller, chunk_size=1000, report=None):
+    """ validates and inserts (line, row) pairs as active listings of seller,
+    returns an ImportReport"""
+    report = report or ImportReport()
+    chunk = []
+
+    try:
+        for line, row in rows:
+            if row is None:
+                report.reject(line, "the line is not a valid row")
+                continue
+
+            form = ImportListingForm(row)
+            if not form.is_valid():
+                report.reject(line, "; ".join(f"{name}: {' '.join(messages)}"
+                    for name, messages in form.errors.items()))
+                continue
+
+            listing = form.instance
+            listing.seller = seller
+            listing.isActive = True
+            listing.currentPrice = listing.initialPrice
+            listing.category_id = form.cleaned_data["category"] or Listing.DEFAULTCATEGORY
+            listing.imageUrl = listing.imageUrl or Listing.DEFAULTIMAGEURL
+            chunk.append(listing)
+
+            if len(chunk) >= chunk_size:
+                report.created += _insert(chunk)
+                chunk = []
+    except ImportFileError as error:
+        report.file_error = str(error)
+
+    if chunk:
+        report.created += _insert(chunk)
+    return report
+
+
+def _insert(listings):
+    with transaction.atomic():
+        Category.objects.bulk_create([Category(name=name) for name in {listing.category_id for listing in listings}],
+            ignore_conflicts=True)
+        Listing.objects.bulk_create(listings)
+        category_counts.adjust(Counter(listing.category_id for listing in listings))
+    return len(listings)
@@ -0,0 +1,153 @@
+""" write-behind bid ingestion
+
+With BID_INGESTION set to "queue", make_bid hands its bid to the process's
+BidQueue rather than writing it itself. A single writer thread takes every bid
+that has queued up, up to BID_BATCH_SIZE, and commits them in one
+transaction: one write lock and one sync to disk for the batch instead of one
+per request, and no requests queueing for SQLite's lock. Within the batch the
+bids are checked in the order they arrived against the listings as the batch
+left them, so they are decided exactly as place_bid would have decided them
+one after the other. Each bidder waits on a future for its bid's outcome, so
+the response still says whether the bid was taken.
+
+Batches only form when several requests wait at once, so this pays off with
+threaded workers or under ASGI and changes nothing for one request at a time.
+The queue lives in memory: bids waiting in it when the process dies are lost
+along with the requests waiting on them.
+"""
+import queue
+import threading
+from concurrent import futures
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+
+from .auction_state import get_states
+from .bidding import BidRejected, BidUndecided, check_bid, lock_for_writing, place_bid, retry_when_locked, rule_out_bid
+from .models import Bid, Listing
+
+
+@dataclass
+class PendingBid:
+    listing_id: int
+    owner: object
+    amount: object
+    future: Future = field(default_factory=Future)
+
+
+class BidQueue:
+    """ a queue of bids drained by one writer thread, started on first use"""
+
+    def __init__(self, batch_size=100):
+        self.batch_size = batch_size
+        self.pending = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def submit(self, listing_id, owner, amount):
+        """ queues a bid, returns a future resolving to the bid or to BidRejected"""
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="bid-writer", daemon=True)
+                self._writer.start()
+        bid = PendingBid(listing_id, owner, amount)
+        self.pending.put(bid)
+        return bid.future
+
+    def stop(self):
+        """ lets the writer finish what is queued and exit"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self.pending.put(None)
+            writer.join()
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is None
+            batch = [bid for bid in batch if bid is not None]
+            if batch:
+                try:
+                    close_old_connections()
+                    outcomes = write_batch(batch)
+                except Exception as error:
+                    outcomes = [error] * len(batch)
+                for bid, outcome in zip(batch, outcomes):
+                    if isinstance(outcome, Exception):
+                        bid.future.set_exception(outcome)
+                    else:
+                        bid.future.set_result(outcome)
+            if stopping:
+                connection.close()
+                return
+
+
+@retry_when_locked
+def write_batch(batch):
+    """ records the bids of a batch that beat the price at their turn in one
+    transaction, returns each one's saved bid or BidRejected"""
+    listing_ids = {bid.listing_id for bid in batch}
+    outcomes = []
+    with transaction.atomic():
+        lock_for_writing(listing_ids)
+        listings = Listing.objects.select_for_update().in_bulk(listing_ids)
+        for pending in batch:
+            listing = listings.get(pending.listing_id)
+            try:
+                if listing is None:
+                    raise BidRejected("error: listing_id not valid")
+                check_bid(listing, pending.amount)
+                # recordBid moves the loaded listing on, so the next bid is checked
+                # against this one. Bid.save's savepoint keeps a failed insert
+                # from taking the batch with it
+                outcomes.append(Bid.objects.create(amount=pending.amount, listing=listing, owner=pending.owner))
+            except (BidRejected, IntegrityError) as error:
+                outcomes.append(error)
+
+        bid_on = {bid.listing_id: bid.listing for bid in outcomes if isinstance(bid, Bid)}
+
+        def committed():
+            for listing in bid_on.values():
+                get_states().remember(listing)
+        transaction.on_commit(committed)
+    return outcomes
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = BidQueue(settings.BID_BATCH_SIZE)
+        return _queue
+
+
+def take_bid(listing_id, user, amount):
+    """ places a bid the way BID_INGESTION says, returns the new bid or raises
+    BidRejected, or BidUndecided when a queued bid isn't decided in time. a
+    bid the listing's known state already rules out is turned away without
+    going to the database"""
+    state = get_states().get(listing_id)
+    if state is None:
+        raise BidRejected("error: listing_id not valid")
+    rule_out_bid(state, amount)
+
+    if settings.BID_INGESTION != "queue":
+        return place_bid(listing_id, user, amount)
+    try:
+        return get_queue().submit(listing_id, user, amount).result(settings.BID_QUEUE_TIMEOUT)
+    except futures.TimeoutError:
+        # the writer may still commit it
+        raise BidUndecided("your bid couldn't be confirmed in time and may still be taken, check the listing")
@@ -0,0 +1,114 @@
+import json
+import platform
+from dataclasses import asdict
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from auctions.benchmark import SCENARIOS, Fixture, run_scenario
+from auctions.datagen import Volumes, count_volumes, generate
+from auctions.ingest import get_queue
+
+SQLITE_DATABASE = "benchmark.sqlite3"
+
+
+class Command(BaseCommand):
+    help = ("Fill a throwaway database with synthetic data and measure the latency and "
+        "throughput of the auction views, writing the results to JSON")
+
+    def add_arguments(self, parser):
+        defaults = Volumes()
+        parser.add_argument("--users", type=int, default=defaults.users)
+        parser.add_argument("--categories", type=int, default=defaults.categories)
+        parser.add_argument("--listings", type=int, default=defaults.listings)
+        parser.add_argument("--bids", type=int, default=defaults.bids)
+        parser.add_argument("--comments", type=int, default=defaults.comments)
+        parser.add_argument("--watched", type=int, default=defaults.watched,
+            help="listings on each user's watchlist")
+        parser.add_argument("--seed", type=int, default=0,
+            help="seed of the data set and of the requests made")
+        parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), dest="scenarios",
+            help="scenario to run, may be repeated, defaults to all of them")
+        parser.add_argument("--requests", type=int, default=1000,
+            help="timed requests per scenario")
+        parser.add_argument("--concurrency", type=int, default=1,
+            help="threads making requests at once, each with its own client")
+        parser.add_argument("--warmup", type=int, default=10,
+            help="untimed requests each thread makes first")
+        parser.add_argument("--bid-ingestion", choices=["direct", "queue"],
+            help="how make_bid writes bids, see auctions/ingest.py, defaults to BID_INGESTION")
+        parser.add_argument("--keepdb", action="store_true",
+            help="keep the benchmark database, and reuse its data on the next run")
+        parser.add_argument("--output", default="benchmark.json")
+        parser.add_argument("--baseline", help="results of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency has to be at least 1")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        # a test database, so the benchmark never writes to the real one. sqlite
+        # gets a file rather than the usual in memory database, so threads and
+        # --keepdb work
+        test_settings = connection.settings_dict["TEST"]
+        if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+            test_settings["NAME"] = SQLITE_DATABASE
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True,
+            serialize=False, keepdb=options["keepdb"])
+
+        try:
+            with override_settings(BID_INGESTION=options["bid_ingestion"] or settings.BID_INGESTION):
+                results = self.run(options)
+        finally:
+            # the bid writer has a connection to the benchmark database
+            get_queue().stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f"results written to {options['output']}")
+
+        for name, summary in results["scenarios"].items():
+            line = (f"{name:<18} {summary['throughput']:>9} req/s  p50 {summary['p50_ms']:>8} ms  "
+                f"p99 {summary['p99_ms']:>8} ms  errors {summary['errors']}")
+            if "rejected" in summary:
+                line += f"  accepted {summary['accepted_throughput']} bids/s, rejected {summary['rejected']}"
+            before = (baseline or {}).get("scenarios", {}).get(name)
+            if before and before.get("p50_ms") and before.get("p99_ms"):
+                line += (f"  (p50 x{summary['p50_ms'] / before['p50_ms']:.2f}, "
+                    f"p99 x{summary['p99_ms'] / before['p99_ms']:.2f} of baseline)")
+            self.stdout.write(line)
+
+    def run(self, options):
+        volumes = Volumes(users=options["users"], categories=options["categories"],
+            listings=options["listings"], bids=options["bids"], comments=options["comments"],
+            watched=options["watched"])
+
+        if count_volumes().listings:
+            self.stdout.write("reusing the data already in the benchmark database")
+            volumes = count_volumes()
+        else:
+            self.stdout.write(f"generating {asdict(volumes)}")
+            generate(volumes, random_seed=options["seed"])
+
+        fixture = Fixture()
+        results = {
+            "started": datetime.now(timezone.utc).isoformat(),
+            "environment": {"python": platform.python_version(), "django": django.get_version(),
+                "database": connection.vendor, "bid_ingestion": settings.BID_INGESTION},
+            "volumes": asdict(volumes),
+            "seed": options["seed"],
+            "scenarios": {},
+        }
+        for name in options["scenarios"] or SCENARIOS:
+            result = run_scenario(name, fixture, options["requests"], options["concurrency"],
+                options["warmup"], options["seed"])
+            results["scenarios"][name] = result.summary()
+        return results
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from auctions.bidding import close_due_auctions
+
+
+class Command(BaseCommand):
+    help = "Close the listings whose end time has passed, once or as a worker loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true",
+            help="keep running, checking for due listings every interval")
+        parser.add_argument("--interval", type=float, default=5.0,
+            help="seconds to wait between checks when nothing is due")
+        parser.add_argument("--batch-size", type=int, default=500,
+            help="most listings closed by one update")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        while True:
+            close_old_connections()
+            closed = close_due_auctions(batch_size=batch_size)
+            if closed:
+                self.stdout.write(f"closed {closed} listing(s)")
+
+            if not options["loop"]:
+                break
+            # a full batch means more are due, so carry on straight away
+            if closed < batch_size:
+                time.sleep(options["interval"])
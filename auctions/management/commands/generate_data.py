@@ -0,0 +1,33 @@
+import time
+from dataclasses import asdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.datagen import Volumes, generate
+
+
+class Command(BaseCommand):
+    help = ("Fill the database with synthetic users, categories, listings, bids, comments and "
+        "watchlists, the same rows for the same seed")
+
+    def add_arguments(self, parser):
+        defaults = Volumes()
+        for volume, value in asdict(defaults).items():
+            parser.add_argument(f"--{volume}", type=int, default=value)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--chunk-size", type=int, default=5000,
+            help="listings inserted per transaction, with their bids and comments")
+
+    def handle(self, *args, **options):
+        volumes = Volumes(**{volume: options[volume] for volume in asdict(Volumes())})
+        started = time.perf_counter()
+
+        def progress(table, done, total):
+            self.stdout.write(f"{table}: {done}/{total}")
+
+        try:
+            generate(volumes, random_seed=options["seed"], chunk_size=options["chunk_size"],
+                progress=progress)
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(f"generated {asdict(volumes)} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auctions.importer import FORMATS, import_listings, read_rows
+from auctions.models import User
+
+
+class Command(BaseCommand):
+    help = "Import listings for a seller from a CSV or JSON lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--seller", required=True, help="username of the seller")
+        parser.add_argument("--format", choices=FORMATS,
+            help="defaults to the file's extension")
+        parser.add_argument("--chunk-size", type=int, default=1000,
+            help="listings inserted per transaction")
+
+    def handle(self, *args, **options):
+        try:
+            seller = User.objects.get(username=options["seller"])
+        except User.DoesNotExist:
+            raise CommandError(f"there is no user called {options['seller']}")
+
+        format = options["format"] or os.path.splitext(options["path"])[1].lstrip(".").lower()
+        if format not in FORMATS:
+            raise CommandError(f"can't tell the format of {options['path']}, pass --format")
+
+        with open(options["path"], newline="", encoding="utf-8") as stream:
+            report = import_listings(read_rows(stream, format), seller, options["chunk_size"])
+
+        for line, message in report.errors:
+            self.stderr.write(f"line {line}: {message}")
+        if report.file_error:
+            raise CommandError(f"{report.file_error}, imported {report.created} listing(s) before it")
+        self.stdout.write(f"imported {report.created} listing(s), {report.failed} row(s) failed")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from auctions.search import ensure_index, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full text search index of listings from the listings table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if not ensure_index(connection):
+            raise CommandError("full text search needs an sqlite database built with fts5")
+
+        rebuild_index(connection)
+        self.stdout.write("search index rebuilt")
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from auctions.category_counts import reconcile
+from auctions.models import Category
+
+
+class Command(BaseCommand):
+    help = "Recount the active listings of each category, once or as a worker loop"
+
+    def add_arguments(self, parser):
+        parser.add_argument("categories", nargs="*",
+            help="only recount these categories, defaults to all of them")
+        parser.add_argument("--loop", action="store_true",
+            help="keep running, recounting every interval")
+        parser.add_argument("--interval", type=float, default=3600.0,
+            help="seconds to wait between recounts")
+
+    def handle(self, *args, **options):
+        names = options["categories"] or None
+        while True:
+            close_old_connections()
+            checked = Category.objects.filter(name__in=names).count() if names else Category.objects.count()
+            repaired = reconcile(names)
+            self.stdout.write(f"checked {checked} categor{'y' if checked == 1 else 'ies'}, repaired {repaired}")
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from auctions.bidding import refresh_bid_stats
+from auctions.models import Listing
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored price, bid count and leader of listings from their bids"
+
+    def add_arguments(self, parser):
+        parser.add_argument("listing_ids", nargs="*", type=int,
+            help="only refresh these listings, defaults to all of them")
+
+    def handle(self, *args, **options):
+        listings = Listing.objects.all()
+        if options["listing_ids"]:
+            listings = listings.filter(pk__in=options["listing_ids"])
+
+        checked = repaired = 0
+        for listing_id in listings.values_list("pk", flat=True).iterator():
+            checked += 1
+            if refresh_bid_stats(listing_id):
+                repaired += 1
+
+        self.stdout.write(f"checked {checked} listing(s), repaired {repaired}")
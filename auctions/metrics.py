@@ -0,0 +1,221 @@
+""" per view request metrics
+
+RequestMetricsMiddleware measures every request routed to a view: the wall
+time, the number of SQL queries and the time spent in them, and the time spent
+rendering templates. The numbers go back to the browser in a Server-Timing
+header and are added to histograms kept per url name, which the metrics view
+serves in the Prometheus text format. Histograms are per process, so each
+worker has to be scraped on its own.
+
+What a request spends is found through a context variable rather than the
+thread it runs on, because under ASGI its database work and rendering run on
+threads other than the middleware's and context variables are carried over to
+them. Every connection gets a wrapper counting queries for whichever request
+is current, so queries are counted on whatever thread they run.
+"""
+import contextvars
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+from .middleware import AsyncCapableMiddleware
+
+# upper bounds of the histogram buckets, the last one catches everything
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, float("inf"))
+
+METRICS = {
+    "auctions_request_seconds": ("wall time of a request", SECONDS_BUCKETS),
+    "auctions_request_queries": ("sql queries run by a request", QUERY_BUCKETS),
+    "auctions_request_db_seconds": ("time a request spent running sql", SECONDS_BUCKETS),
+    "auctions_request_template_seconds": ("time a request spent rendering templates", SECONDS_BUCKETS),
+}
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """ what one request has spent so far"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.templates = 0.0
+        self.total = 0.0
+        # includes and crispy forms render templates inside templates, only the
+        # outermost render is timed
+        self.template_depth = 0
+
+    def sql(self, execute, sql, params, many, context):
+        """ a database execute_wrapper counting and timing queries"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self):
+        return (f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries", '
+            f"tpl;dur={self.templates * 1000:.1f}, total;dur={self.total * 1000:.1f}")
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+# (metric, view) -> Histogram
+_histograms = {}
+
+
+def record(view, timings):
+    values = {
+        "auctions_request_seconds": timings.total,
+        "auctions_request_queries": timings.queries,
+        "auctions_request_db_seconds": timings.db,
+        "auctions_request_template_seconds": timings.templates,
+    }
+    with _lock:
+        for metric, value in values.items():
+            key = (metric, view)
+            if key not in _histograms:
+                _histograms[key] = Histogram(METRICS[metric][1])
+            _histograms[key].observe(value)
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def _number(value):
+    return "+Inf" if value == float("inf") else repr(value)
+
+
+def render():
+    """ the histograms in the Prometheus text exposition format"""
+    with _lock:
+        snapshot = {key: (list(h.counts), h.sum, h.count) for key, h in _histograms.items()}
+
+    lines = []
+    for metric, (help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for (name, view), (counts, total, count) in sorted(snapshot.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{view="{view}",le="{_number(bound)}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{view="{view}"}} {_number(total)}')
+            lines.append(f'{metric}_count{{view="{view}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+_template_render = None
+
+
+def instrument_templates():
+    """ wraps Template.render so the request being measured is charged for it"""
+    global _template_render
+    if _template_render is not None:
+        return
+    _template_render = Template.render
+
+    def render(self, context):
+        timings = _current.get()
+        if timings is None or timings.template_depth:
+            return _template_render(self, context)
+
+        timings.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return _template_render(self, context)
+        finally:
+            timings.templates += time.perf_counter() - start
+            timings.template_depth -= 1
+
+    Template.render = render
+
+
+def record_sql(execute, sql, params, many, context):
+    """ a database execute_wrapper charging queries to the current request"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.sql(execute, sql, params, many, context)
+
+
+def instrument_connection(sender=None, connection=None, **kwargs):
+    # connection_created is sent again when a closed connection reconnects
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+def instrument_connections():
+    connection_created.connect(instrument_connection)
+    for connection in connections.all():
+        instrument_connection(connection=connection)
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match.route
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.detect_async(get_response)
+        instrument_templates()
+        instrument_connections()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, start)
+
+    def finish(self, request, response, timings, start):
+        timings.total = time.perf_counter() - start
+        record(view_name(request), timings)
+        response["Server-Timing"] = timings.server_timing()
+        return response
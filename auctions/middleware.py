@@ -0,0 +1,44 @@
+""" middleware that can run on either side of Django's request handling
+
+Django only keeps a request on the event loop under ASGI when every
+middleware can be called asynchronously. Otherwise it switches to a thread at
+the first one that can't and holds that thread until the response is back.
+"""
+import asyncio
+
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncCapableMiddleware:
+    """ a middleware django can call from either kind of chain. subclasses call
+    detect_async with the get_response they are given and answer through an
+    __acall__ coroutine when is_async is set"""
+    sync_capable = True
+    async_capable = True
+
+    def detect_async(self, get_response):
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # how django tells that the middleware is a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class StaticFilesMiddleware(AsyncCapableMiddleware, WhiteNoiseMiddleware):
+    """ WhiteNoiseMiddleware that also runs in an async middleware chain.
+    outside of DEBUG looking a file up is a dictionary lookup, so it is done on
+    the event loop"""
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.detect_async(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
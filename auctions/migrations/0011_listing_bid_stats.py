@@ -0,0 +1,50 @@
+# Generated by Django 3.0.8 on 2026-10-18 19:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_bid_stats(apps, schema_editor):
+    Listing = apps.get_model("auctions", "Listing")
+    Bid = apps.get_model("auctions", "Bid")
+
+    for listing in Listing.objects.all().iterator():
+        bids = Bid.objects.filter(listing=listing)
+        top = bids.order_by("-amount", "id").first()
+        listing.bidCount = bids.count()
+        listing.leadingBid = top
+        listing.leadingBidder_id = top.owner_id if top else None
+        listing.currentPrice = top.amount if top else listing.initialPrice
+        listing.save(update_fields=["currentPrice", "bidCount", "leadingBid", "leadingBidder"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0010_auto_20200901_1743'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='bidCount',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='currentPrice',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True, verbose_name='Current price'),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='leadingBid',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='auctions.Bid'),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='leadingBidder',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_bid_stats, migrations.RunPython.noop),
+    ]
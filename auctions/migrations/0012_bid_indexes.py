@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0011_listing_bid_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['listing', '-amount'], name='bid_listing_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bid',
+            index=models.Index(fields=['owner', '-id'], name='bid_owner_id_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0012_bid_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['isActive', 'id'], name='listing_active_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['category', 'isActive', 'id'], name='listing_cat_active_id_idx'),
+        ),
+    ]
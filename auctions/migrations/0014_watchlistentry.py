@@ -0,0 +1,27 @@
+# Generated by Django 3.0.8 on 2026-10-18 19:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0013_listing_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchlistEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('listing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watchers', to='auctions.Listing')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='watchlist', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='watchlistentry',
+            constraint=models.UniqueConstraint(fields=('user', 'listing'), name='unique_watchlist_entry'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import migrations
+
+
+def import_session_watchlists(apps, schema_editor):
+    """ copies the listing ids kept under "watchlist" in logged in sessions into
+    WatchlistEntry rows"""
+    Session = apps.get_model("sessions", "Session")
+    User = apps.get_model("auctions", "User")
+    Listing = apps.get_model("auctions", "Listing")
+    WatchlistEntry = apps.get_model("auctions", "WatchlistEntry")
+    store = SessionStore()
+
+    for session in Session.objects.iterator():
+        data = store.decode(session.session_data)
+        user_id, watchlist = data.get("_auth_user_id"), data.get("watchlist")
+        if not watchlist or not User.objects.filter(pk=user_id).exists():
+            continue
+
+        # listings may have been deleted since they were watched
+        listing_ids = Listing.objects.filter(pk__in=watchlist).values_list("pk", flat=True)
+        WatchlistEntry.objects.bulk_create(
+            [WatchlistEntry(user_id=user_id, listing_id=listing_id) for listing_id in listing_ids],
+            ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0014_watchlistentry'),
+        ('sessions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(import_session_watchlists, migrations.RunPython.noop),
+    ]
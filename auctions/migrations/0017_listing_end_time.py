@@ -0,0 +1,36 @@
+# Generated by Django 3.0.8 on 2026-10-18 19:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_winners(apps, schema_editor):
+    # listings closed before winners were recorded were won by their leader
+    Listing = apps.get_model("auctions", "Listing")
+    Listing.objects.filter(isActive=False).update(winner=models.F("leadingBidder"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0016_listing_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='endsAt',
+            field=models.DateTimeField(blank=True, help_text='YYYY-MM-DD HH:MM, leave empty to close the listing yourself', null=True, verbose_name='Auction end'),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='winner',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='won_listings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(fields=['isActive', 'endsAt'], name='listing_active_ends_idx'),
+        ),
+        migrations.RunPython(record_winners, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+def backfill_active_counts(apps, schema_editor):
+    Category = apps.get_model("auctions", "Category")
+    Listing = apps.get_model("auctions", "Listing")
+
+    counts = (Listing.objects.filter(isActive=True).order_by().values_list("category")
+        .annotate(count=models.Count("id")))
+    for name, count in counts:
+        Category.objects.filter(name=name).update(activeCount=count)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0018_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='activeCount',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_active_counts, migrations.RunPython.noop),
+    ]
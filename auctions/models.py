@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .pagination import keyset_page
 
 class User(AbstractUser):
     pass
@@ -7,9 +12,46 @@ class User(AbstractUser):
 class Category(models.Model):
 	name = models.CharField(max_length=50, unique=True)
 
+	# how many of the category's listings are active, adjusted as listings are
+	# created, closed and deleted so the categories page never counts listings
+	activeCount = models.PositiveIntegerField(default=0, editable=False)
+
+	@classmethod
+	def adjustActiveCounts(cls, deltas):
+		""" adds each delta in a dict of category names to deltas to that
+		category's active count"""
+		for name, delta in deltas.items():
+			if delta:
+				cls.objects.filter(name=name).update(activeCount=models.F("activeCount") + delta)
+
+	@classmethod
+	def recountActive(cls, names=None):
+		""" recomputes the active counts from the listings table, of only the
+		named categories if given. returns how many had drifted"""
+		categories = cls.objects.all() if names is None else cls.objects.filter(name__in=names)
+		active = (Listing.objects.filter(category=models.OuterRef("name"), isActive=True)
+			.order_by().values("category").annotate(count=models.Count("id")).values("count"))
+		actual = Coalesce(models.Subquery(active), 0)
+		drifted = categories.annotate(actual=actual).exclude(activeCount=models.F("actual"))
+		return categories.filter(pk__in=drifted.values("pk")).update(activeCount=actual)
+
 	def __str__(self):
 		return self.name
 
+class ListingQuerySet(models.QuerySet):
+	""" query plans for the pages listings are shown on, each one loads a page
+	in a fixed number of queries however many rows it shows"""
+
+	def cards(self):
+		""" only the fields a card in _listings.html renders"""
+		return self.select_related("category").only(
+			"id", "title", "description", "currentPrice", "imageUrl", "category__name")
+
+	def detail(self):
+		""" a listing with its seller and category, its comments are paged in
+		separately with Comment.page"""
+		return self.select_related("seller", "category")
+
 class Listing(models.Model):
 	title = models.CharField("Listing Title", max_length=100)
 	seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="listings")
@@ -17,6 +59,7 @@ class Listing(models.Model):
 	description = models.TextField("Listing Description")
 	isActive = models.BooleanField()
 
+	DEFAULTIMAGEURL = "https://res.cloudinary.com/opuye/image/upload/h_300,c_scale/v1598563707/no-image.png"
 	imageUrl = models.URLField("Image Link", 
 					help_text="if no value is put a default value will be assigned", 
 					blank=True)
@@ -25,37 +68,124 @@ class Listing(models.Model):
 	category = models.ForeignKey(Category, on_delete=models.CASCADE, to_field="name", related_name="listings",
 									 default=DEFAULTCATEGORY)
 
+	endsAt = models.DateTimeField("Auction end", null=True, blank=True,
+					help_text="YYYY-MM-DD HH:MM, leave empty to close the listing yourself")
+
+	objects = ListingQuerySet.as_manager()
+
+	# the auction state is kept on the listing itself and updated whenever a bid
+	# is saved, so reading the price or the leader never aggregates over bids
+	currentPrice = models.DecimalField("Current price", max_digits=12, decimal_places=2,
+					null=True, editable=False)
+	bidCount = models.PositiveIntegerField(default=0, editable=False)
+	leadingBid = models.ForeignKey("Bid", on_delete=models.SET_NULL, null=True, editable=False,
+					related_name="+")
+	leadingBidder = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, editable=False,
+					related_name="leading_listings")
+	# the leader at the moment the listing was closed
+	winner = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, editable=False,
+					related_name="won_listings")
+
+	class Meta:
+		indexes = [
+			# the active feeds are walked newest first by id, see pagination.py
+			models.Index(fields=["isActive", "id"], name="listing_active_id_idx"),
+			models.Index(fields=["category", "isActive", "id"], name="listing_cat_active_id_idx"),
+			# the closing scheduler looks for active listings past their end
+			models.Index(fields=["isActive", "endsAt"], name="listing_active_ends_idx"),
+		]
+
+	# written by bidding and closing alone, never by saving a listing edited elsewhere
+	BID_STATE_FIELDS = ("currentPrice", "bidCount", "leadingBid", "leadingBidder", "winner")
+
+	def save(self, *args, **kwargs):
+		# until somebody bids the current price is the start price
+		if self.leadingBid_id is None:
+			self.currentPrice = self.initialPrice
+		adding = self._state.adding
+		# a row loaded before a bid committed would write the bid's state back
+		# over it, so an edit saves everything but the bid state
+		editing = not adding and not args and not kwargs.get("force_insert") and kwargs.get("update_fields") is None
+		if editing:
+			kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+				if not field.primary_key and field.name not in self.BID_STATE_FIELDS]
+		# a new active listing and its category's count are written together
+		with transaction.atomic():
+			super().save(*args, **kwargs)
+			if adding and self.isActive:
+				Category.adjustActiveCounts({self.category_id: 1})
+			if editing and self.leadingBid_id is None:
+				# only while still nobody has bid
+				Listing.objects.filter(pk=self.pk, leadingBid__isnull=True).update(
+					currentPrice=models.F("initialPrice"))
+
 	def isClosed(self):
 		""" returns true is a listing is closed"""
 		return not self.isActive
 
+	def hasEnded(self, now=None):
+		""" returns true if the listing's end time has passed, it may not have
+		been closed yet"""
+		return self.endsAt is not None and self.endsAt <= (now or timezone.now())
+
 	def isValidBid(self, newBid):
 		""" takes any numerical arguement that can be passed as an arguement
 		to decimal as an arguement and returns true if the bid is bigger than 
 		existing bids"""
 
-		bid = self.bids.all().aggregate(models.Max("amount"))["amount__max"]
-		if bid:
-			return newBid > bid
+		if self.leadingBid_id is not None:
+			return newBid > self.currentPrice
 		return newBid >= self.initialPrice
 
 	def highestBid(self):
-		highest_bid = self.bids.all().aggregate(models.Max("amount"))["amount__max"]
-		try:
-			highest_bid = Bid.objects.get(amount=highest_bid)
-		except Bid.DoesNotExist:
-			return None
-
-		return highest_bid
+		""" returns the leading bid, or none if the listing has no bids"""
+		return self.leadingBid
 
 	def highestBidder(self):
 		""" returns the owner of the highest bid, or none if listing doesn't exist"""
-		bid = self.highestBid()
+		return self.leadingBidder
 
-		if bid is not None:
-			return bid.owner
-		else:
-			return None
+	def topBid(self):
+		""" looks up the highest bid on this listing in the bids table, the
+		earliest one wins a tie. served by the (listing, -amount) index"""
+		return self.bids.order_by("-amount", "id").first()
+
+	def recordBid(self, bid):
+		""" folds a newly saved bid into the stored auction state and returns
+		true if it became the leading bid"""
+		listing = Listing.objects.filter(pk=self.pk)
+		listing.update(bidCount=models.F("bidCount") + 1)
+		self.bidCount += 1
+
+		# only take the lead if the bid beats whatever is stored right now
+		leads = listing.filter(
+			models.Q(leadingBid__isnull=True) | models.Q(currentPrice__lt=bid.amount)
+		).update(currentPrice=bid.amount, leadingBid=bid, leadingBidder=bid.owner_id)
+
+		if leads:
+			self.currentPrice = bid.amount
+			self.leadingBid = bid
+			self.leadingBidder_id = bid.owner_id
+		return bool(leads)
+
+	def refreshBidStats(self):
+		""" recomputes the stored auction state from the bids table, returns
+		true if anything had drifted. a bid committed meanwhile would be
+		overwritten, so live listings are repaired through
+		bidding.refresh_bid_stats"""
+		before = (self.currentPrice, self.bidCount, self.leadingBid_id, self.leadingBidder_id)
+
+		top = self.topBid()
+		self.bidCount = self.bids.count()
+		self.leadingBid = top
+		self.leadingBidder_id = top.owner_id if top else None
+		self.currentPrice = top.amount if top else self.initialPrice
+
+		after = (self.currentPrice, self.bidCount, self.leadingBid_id, self.leadingBidder_id)
+		if before == after:
+			return False
+		self.save(update_fields=["currentPrice", "bidCount", "leadingBid", "leadingBidder"])
+		return True
 
 	def __str__(self):
 		return f"{self.title} currently selling at ${self.initialPrice}"
@@ -65,6 +195,22 @@ class Bid(models.Model):
 	listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="bids")
 	owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="bids")
 
+	class Meta:
+		indexes = [
+			# a listing's top bid and its bid history are both read highest first
+			models.Index(fields=["listing", "-amount"], name="bid_listing_amount_idx"),
+			# a user's bids, newest first
+			models.Index(fields=["owner", "-id"], name="bid_owner_id_idx"),
+		]
+
+	def save(self, *args, **kwargs):
+		# a new bid and the listing state it changes are written together
+		adding = self._state.adding
+		with transaction.atomic():
+			super().save(*args, **kwargs)
+			if adding:
+				self.listing.recordBid(self)
+
 	def __str__(self):
 		return f"{self.amount} bid for {self.listing.title}"
 
@@ -72,7 +218,42 @@ class Comment(models.Model):
 	comment = models.TextField("Leave a comment")
 	commenter = models.ForeignKey(User, on_delete=models.CASCADE, related_name="comments")
 	listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="comments")
+
+	class Meta:
+		indexes = [
+			# a listing's comments are paged newest first by id
+			models.Index(fields=["listing", "id"], name="comment_listing_id_idx"),
+		]
+
+	@classmethod
+	def page(cls, listing_id, cursor=None):
+		""" one keyset page of a listing's comments with their commenters, newest
+		first, and the cursor of the next page"""
+		comments = cls.objects.filter(listing=listing_id).select_related("commenter").only(
+			"id", "comment", "listing_id", "commenter__username")
+		return keyset_page(comments, cursor, settings.COMMENTS_PAGE_SIZE)
 	
 	def __str__(self):
 		return f"{self.commenter.get_username()}'s comment"
 
+
+class WatchlistEntry(models.Model):
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="watchlist")
+	listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name="watchers")
+
+	class Meta:
+		constraints = [
+			# also the index membership checks are answered from
+			models.UniqueConstraint(fields=["user", "listing"], name="unique_watchlist_entry"),
+		]
+
+	@classmethod
+	def watchedAmong(cls, user, listing_ids):
+		""" returns the set of listing_ids that are on user's watchlist, in one query"""
+		if not user.is_authenticated or not listing_ids:
+			return set()
+		return set(cls.objects.filter(user=user, listing_id__in=listing_ids)
+			.values_list("listing_id", flat=True))
+
+	def __str__(self):
+		return f"listing {self.listing_id} on user {self.user_id}'s watchlist"
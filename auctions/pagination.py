@@ -0,0 +1,90 @@
+""" keyset pagination for listing feeds
+
+Pages are walked newest first by id and the cursor is the id of the last row
+on the previous page, so fetching any page is an index range scan of page size
+rows no matter how deep into the feed it is. A listing's bids are walked
+highest amount first instead, with the amount and id of the last bid as the
+cursor, which their (listing, -amount) index serves the same way.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """ raised when a cursor taken from a url isn't a valid id"""
+
+
+def get_cursor(request):
+    """ reads the cursor from the query string, none means the first page"""
+    cursor = request.GET.get("cursor")
+    if cursor is None:
+        return None
+    try:
+        cursor = int(cursor)
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if cursor < 1:
+        raise InvalidCursor(cursor)
+    return cursor
+
+
+def keyset_page(queryset, cursor=None, page_size=None):
+    """ returns the page of queryset after cursor and the cursor of the page
+    following it, which is none on the last page"""
+    page_size = page_size or settings.LISTINGS_PAGE_SIZE
+
+    queryset = queryset.order_by("-id")
+    if cursor is not None:
+        queryset = queryset.filter(id__lt=cursor)
+
+    # one extra row tells us whether there is another page without a count
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        last = items[page_size - 1]
+        # pages of values() rows are dicts
+        next_cursor = last["id"] if isinstance(last, dict) else last.id
+    return items[:page_size], next_cursor
+
+
+def get_amount_cursor(request):
+    """ reads an <amount>_<id> cursor from the query string as (amount, id),
+    none means the first page"""
+    cursor = request.GET.get("cursor")
+    if cursor is None:
+        return None
+    try:
+        amount, id = cursor.split("_")
+        amount, id = Decimal(amount), int(id)
+    except (ValueError, InvalidOperation):
+        raise InvalidCursor(cursor)
+    if not amount.is_finite() or id < 1:
+        raise InvalidCursor(cursor)
+    return amount, id
+
+
+def amount_keyset_page(queryset, cursor=None, page_size=None):
+    """ keyset_page for rows walked highest amount first, the newest first
+    among equal amounts"""
+    page_size = page_size or settings.LISTINGS_PAGE_SIZE
+
+    queryset = queryset.order_by("-amount", "-id")
+    if cursor is not None:
+        amount, id = cursor
+        # the bound on amount alone is what lets the index skip to the cursor
+        queryset = queryset.filter(amount__lte=amount).filter(Q(amount__lt=amount) | Q(id__lt=id))
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        last = items[page_size - 1]
+        if not isinstance(last, dict):
+            last = {"amount": last.amount, "id": last.id}
+        next_cursor = (last["amount"], last["id"])
+    return items[:page_size], next_cursor
+
+
+def format_amount_cursor(cursor):
+    return None if cursor is None else f"{cursor[0]}_{cursor[1]}"
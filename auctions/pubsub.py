@@ -0,0 +1,76 @@
+""" publish/subscribe of listing updates
+
+The live bid streams in streams.py subscribe to a channel per listing and the
+code that changes a listing publishes its new state there. The default broker
+fans messages out inside one process, which is all a single ASGI server
+needs. Deployments with several processes point AUCTIONS_PUBSUB_BACKEND at a
+class with the same publish, subscribe and has_subscribers methods built on a
+shared server such as Redis, where has_subscribers can simply return true.
+"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LocalBroker:
+    """ fans messages out to the subscribers of this process. publish may be
+    called from any thread, messages are handed to each subscriber's event loop"""
+
+    # a subscriber that falls this far behind starts missing messages instead
+    # of holding memory for them
+    QUEUE_SIZE = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def has_subscribers(self, channel):
+        with self._lock:
+            return bool(self._subscribers.get(channel))
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, message)
+
+    @staticmethod
+    def _deliver(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        """ yields a queue receiving the messages published to channel"""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.QUEUE_SIZE))
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[channel].remove(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """ the broker named by the AUCTIONS_PUBSUB_BACKEND setting, one per process"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.AUCTIONS_PUBSUB_BACKEND)()
+        return _broker
+
+
+def listing_channel(listing_id):
+    return f"listing:{listing_id}"
@@ -0,0 +1,149 @@
+""" full text search over listings
+
+On SQLite listings are indexed in an FTS5 table that mirrors the title and
+description columns of auctions_listing and is kept in step by triggers, so
+listings created through bulk inserts or raw updates are indexed as well.
+Searches are ranked with bm25, weighing the title above the description.
+
+SQLite drops a table's triggers whenever a migration rebuilds the table, so
+ensure_index runs after every migrate and puts them back, rebuilding the index
+when they were missing. Databases without FTS5 fall back to a LIKE scan.
+"""
+import re
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.models import Q
+
+from .models import Listing
+
+FTS_TABLE = "auctions_listing_fts"
+
+TRIGGERS = {
+    f"{FTS_TABLE}_insert": f"""
+        CREATE TRIGGER {FTS_TABLE}_insert AFTER INSERT ON auctions_listing BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, title, description)
+                VALUES (new.id, new.title, new.description);
+        END""",
+    f"{FTS_TABLE}_delete": f"""
+        CREATE TRIGGER {FTS_TABLE}_delete AFTER DELETE ON auctions_listing BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+        END""",
+    # only text changes touch the index, bids updating the price don't
+    f"{FTS_TABLE}_update": f"""
+        CREATE TRIGGER {FTS_TABLE}_update AFTER UPDATE OF title, description ON auctions_listing BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO {FTS_TABLE}(rowid, title, description)
+                VALUES (new.id, new.title, new.description);
+        END""",
+}
+
+# bm25 weights of the title and description columns
+TITLE_WEIGHT, DESCRIPTION_WEIGHT = 10.0, 1.0
+
+
+def _sqlite_objects(cursor, kind):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = %s", [kind])
+    return {name for name, in cursor.fetchall()}
+
+
+def ensure_index(conn=connection):
+    """ creates the fts table and its triggers where they are missing, returns
+    true if the index is usable"""
+    if conn.vendor != "sqlite":
+        return False
+
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+                    title, description, content='auctions_listing', content_rowid='id',
+                    tokenize='porter unicode61')""")
+        except OperationalError:
+            # sqlite was built without fts5
+            return False
+
+        missing = set(TRIGGERS) - _sqlite_objects(cursor, "trigger")
+        for name in missing:
+            cursor.execute(TRIGGERS[name])
+
+    # rows written while the triggers were gone aren't in the index
+    if missing:
+        rebuild_index(conn)
+    return True
+
+
+def drop_triggers(conn=connection):
+    """ stops keeping the index in step, for bulk loads that would otherwise
+    index row by row. ensure_index puts the triggers back and rebuilds it"""
+    if conn.vendor != "sqlite":
+        return
+    with conn.cursor() as cursor:
+        for name in TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_index(conn=connection):
+    """ reindexes every listing from the listings table"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def index_available(conn=connection):
+    if conn.vendor != "sqlite":
+        return False
+    with conn.cursor() as cursor:
+        return FTS_TABLE in _sqlite_objects(cursor, "table")
+
+
+def match_expression(query):
+    """ turns what a user typed into an fts5 query matching every word as a
+    prefix, so no fts syntax typed by users is ever interpreted"""
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_listings(query, category=None, active_only=True, limit=None):
+    """ returns up to limit listing cards matching query, best match first"""
+    limit = limit or settings.SEARCH_RESULTS_LIMIT
+    expression = match_expression(query)
+    if not expression:
+        return []
+
+    if not index_available():
+        return _scan_listings(query, category, active_only, limit)
+
+    sql = f"""
+        SELECT listing.id FROM {FTS_TABLE}
+        JOIN auctions_listing listing ON listing.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s"""
+    params = [expression]
+    if active_only:
+        sql += " AND listing.isActive"
+    if category:
+        sql += " AND listing.category_id = %s"
+        params.append(category)
+    sql += f" ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s"
+    params += [TITLE_WEIGHT, DESCRIPTION_WEIGHT, limit]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ranked_ids = [pk for pk, in cursor.fetchall()]
+
+    listings = Listing.objects.cards().in_bulk(ranked_ids)
+    return [listings[pk] for pk in ranked_ids if pk in listings]
+
+
+def _scan_listings(query, category, active_only, limit):
+    """ the slow path for databases without an fts index"""
+    listings = Listing.objects.cards()
+    for word in re.findall(r"\w+", query):
+        listings = listings.filter(Q(title__icontains=word) | Q(description__icontains=word))
+    if active_only:
+        listings = listings.filter(isActive=True)
+    if category:
+        listings = listings.filter(category_id=category)
+    return list(listings.order_by("-id")[:limit])
@@ -0,0 +1,67 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import category_counts, fragments, search
+from .auction_state import get_states
+from .streams import publish_listing
+from .models import Bid, Category, Listing
+
+
+def listing_changed(*listing_ids):
+    """ drops the cached cards now and again once the change is committed, so a
+    render that read the old row in between can't stay cached. live viewers get
+    the new state once it is committed"""
+    fragments.invalidate(*listing_ids)
+
+    def committed():
+        fragments.invalidate(*listing_ids)
+        get_states().changed(listing_ids)
+        for listing_id in listing_ids:
+            publish_listing(listing_id)
+    transaction.on_commit(committed)
+
+
+@receiver(post_save, sender=Listing)
+def listing_saved(sender, instance, created, **kwargs):
+    listing_changed(instance.id)
+    # Listing.save has counted it
+    if created and instance.isActive:
+        category_counts.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    category_counts.invalidate()
+
+
+@receiver(post_delete, sender=Listing)
+def listing_deleted(sender, instance, **kwargs):
+    if instance.isActive:
+        category_counts.adjust({instance.category_id: -1})
+
+
+@receiver(post_save, sender=Bid)
+def bid_saved(sender, instance, created, **kwargs):
+    if created:
+        listing_changed(instance.listing_id)
+
+
+@receiver(post_delete, sender=Bid)
+def bid_deleted(sender, instance, **kwargs):
+    # the stored price and count still include the bid, and it may have led
+    from .bidding import refresh_bid_stats
+    listing_id = instance.listing_id
+    transaction.on_commit(lambda: refresh_bid_stats(listing_id))
+    listing_changed(listing_id)
+
+
+def search_index_migrated(sender, using, **kwargs):
+    # connected in AuctionsConfig.ready, migrations can drop the index triggers
+    search.ensure_index(connections[using])
+
+
+def auction_states_migrated(sender, **kwargs):
+    # connected in AuctionsConfig.ready, migrate and flush can change any listing
+    get_states().clear()
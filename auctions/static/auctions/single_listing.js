@@ -2,18 +2,46 @@ document.addEventListener('DOMContentLoaded', function() {
 
 	const listing_id = JSON.parse(document.getElementById("get-id").textContent);
 	
-	const check_if_listing_in_watchlist = async() =>
+	// the page is rendered with the listing's watchlist state, no need to ask for it
+	update_watchlist_button(JSON.parse(document.getElementById("in-watchlist").textContent))
+
+	// follow new bids and the listing closing as they happen
+	if (window.EventSource)
 	{
-		const response = await fetch(`/in_watchlist?listing_id=${listing_id}`)
-		const data = await response.json();
-		if (data.success == true)
-		{
-			console.log(data.in_watchlist)
-			update_watchlist_button(data.in_watchlist)
+		const events = new EventSource(`/listings/${listing_id}/events`)
+		events.onmessage = function(message) {
+			const state = JSON.parse(message.data)
+			update_auction_state(state)
+			if (!state.active)
+			{
+				events.close()
+			}
 		}
+	}
 
+	// the page comes with the newest comments, older ones are loaded on request
+	const more_comments = document.querySelector("#more-comments")
+	if (more_comments !== null)
+	{
+		more_comments.onclick = function() {
+			this.disabled = true
+			fetch(`/api/v1/listings/${listing_id}/comments?cursor=${this.dataset.cursor}`)
+			.then(response => response.json())
+			.then(data => {
+				const pager = this.parentNode
+				data.comments.forEach(comment => pager.before(comment_element(comment)))
+				if (data.next_cursor === null)
+				{
+					pager.remove()
+				}
+				else
+				{
+					this.dataset.cursor = data.next_cursor
+					this.disabled = false
+				}
+			});
+		}
 	}
-	check_if_listing_in_watchlist()
 
 	// toggle between adding to watchlist and removing from watchlist on click
 	document.querySelector("#edit-watchlist").onclick = function() {
@@ -68,6 +96,10 @@ document.addEventListener('DOMContentLoaded', function() {
 function update_watchlist_button(in_watchlist)
 {
 	const watchlist = document.querySelector("#edit-watchlist");
+	if (watchlist === null)
+	{
+		return
+	}
 	if (in_watchlist === true)
 	{
 		watchlist.dataset.action = "delete"
@@ -78,4 +110,37 @@ function update_watchlist_button(in_watchlist)
 		watchlist.dataset.action = "add"
 		watchlist.innerText = "add to watchlist"		
 	}
+}
+
+function comment_element(comment)
+{
+	// textContent, so a comment can't inject markup
+	const element = document.createElement("div")
+	element.className = "comment"
+	const heading = document.createElement("h5")
+	heading.textContent = ` ${comment.commenter} says:  `
+	const body = document.createElement("p")
+	body.textContent = comment.comment
+	element.append(heading, body)
+	return element
+}
+
+function update_auction_state(state)
+{
+	document.querySelector("#current-price").innerText = formatter.format(state.price)
+
+	const bid_count = document.querySelector("#bid-count")
+	if (bid_count !== null)
+	{
+		bid_count.innerText = state.bids
+	}
+	if (!state.active)
+	{
+		document.querySelector("#closed-alert").hidden = false
+		const bid_form = document.querySelector("#bid-form")
+		if (bid_form !== null)
+		{
+			bid_form.hidden = true
+		}
+	}
 }
\ No newline at end of file
@@ -0,0 +1,150 @@
+""" live listing updates as server-sent events
+
+GET /listings/<id>/events is answered by the ASGI application in
+commerce/asgi.py with an event stream. It sends the listing's auction state
+right away and then again every time a bid or a close is committed, and ends
+once the listing has closed. Under WSGI the same url gets a 204 from Django,
+which tells EventSource not to reconnect.
+
+ASGIHandler is Django's handler, except that it sends responses that can be
+iterated asynchronously, such as the bid history exports, that way rather
+than reading them on the event loop.
+"""
+import asyncio
+import io
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import DisallowedHost
+from django.core.handlers import asgi
+from django.db import close_old_connections
+
+from .models import Listing
+from .pubsub import get_broker, listing_channel
+
+EVENTS_PATH = re.compile(r"^/listings/(?P<listing_id>\d+)/events$")
+
+
+def listing_state(listing_id):
+    """ the auction state pushed to listing pages, or none if there's no such listing"""
+    state = Listing.objects.filter(pk=listing_id).values("id", "currentPrice", "bidCount", "isActive").first()
+    if state is None:
+        return None
+    return {"listing": state["id"], "price": str(state["currentPrice"]),
+        "bids": state["bidCount"], "active": state["isActive"]}
+
+
+def current_state(listing_id):
+    """ listing_state for the streams, which run outside django's request cycle,
+    so nothing else closes a connection that has gone bad or too old"""
+    close_old_connections()
+    try:
+        return listing_state(listing_id)
+    finally:
+        close_old_connections()
+
+
+def publish_listing(listing_id):
+    """ pushes the committed state of a listing to anyone watching it live"""
+    broker = get_broker()
+    channel = listing_channel(listing_id)
+    if not broker.has_subscribers(channel):
+        return
+
+    state = listing_state(listing_id)
+    if state is not None:
+        broker.publish(channel, state)
+
+
+def event(state):
+    return f"data: {json.dumps(state)}\n\n".encode()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def listing_events(scope, receive, send, listing_id):
+    """ streams the state of one listing until it closes or the client leaves"""
+    async with get_broker().subscribe(listing_channel(listing_id)) as updates:
+        # subscribe before reading the state so nothing committed in between is missed
+        state = await sync_to_async(current_state, thread_sensitive=True)(listing_id)
+        if state is None:
+            await send({"type": "http.response.start", "status": 404,
+                "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b"no such listing"})
+            return
+
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream"),
+            (b"cache-control", b"no-cache"),
+        ]})
+        await send({"type": "http.response.body", "body": event(state), "more_body": True})
+
+        disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            while state["active"]:
+                update = asyncio.ensure_future(updates.get())
+                done, _ = await asyncio.wait({update, disconnect}, timeout=settings.EVENTS_KEEPALIVE,
+                    return_when=asyncio.FIRST_COMPLETED)
+                if disconnect in done:
+                    update.cancel()
+                    return
+
+                if update in done:
+                    state = update.result()
+                    body = event(state)
+                else:
+                    # a comment line keeps proxies from timing the stream out
+                    update.cancel()
+                    body = b": keepalive\n\n"
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnect.cancel()
+
+
+def streams_events(scope):
+    """ whether a request is a GET django would serve, the host has to be one
+    of ALLOWED_HOSTS like for any other url"""
+    if scope["method"] != "GET":
+        return False
+    try:
+        asgi.ASGIRequest(scope, io.BytesIO()).get_host()
+    except DisallowedHost:
+        return False
+    return True
+
+
+def with_listing_events(django_application):
+    """ wraps the django asgi application, serving the event streams itself.
+    anything else sent to their urls is left to django to answer or refuse"""
+    async def application(scope, receive, send):
+        if scope["type"] == "http":
+            match = EVENTS_PATH.match(scope["path"])
+            if match and streams_events(scope):
+                return await listing_events(scope, receive, send, int(match["listing_id"]))
+        return await django_application(scope, receive, send)
+    return application
+
+
+class ASGIHandler(asgi.ASGIHandler):
+
+    async def send_response(self, response, send):
+        if not hasattr(response, "async_content"):
+            return await super().send_response(response, send)
+
+        headers = [(header.encode("ascii"), value.encode("latin1")) for header, value in response.items()]
+        headers += [(b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+            for cookie in response.cookies.values()]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        try:
+            async for part in response.async_content():
+                await send({"type": "http.response.body", "body": part, "more_body": True})
+            await send({"type": "http.response.body"})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
@@ -0,0 +1,16 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from auctions import fragments
+
+register = template.Library()
+
+
+@register.simple_tag
+def listing_card(listing):
+    """ renders _listings.html for a listing through the card cache, unless
+    fragments.render_cards already has"""
+    html = getattr(listing, "cardHtml", None)
+    if html is None:
+        html = fragments.render_card(listing)
+    return mark_safe(html)
@@ -1,20 +1,47 @@
-from django.test import TestCase, Client
-from django.urls import reverse
 from django.conf import settings
-
-from importlib import import_module
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import Count, F, Max
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from concurrent.futures import Future
+from contextlib import contextmanager
+from unittest import mock, skipUnless
+from datetime import timedelta
+from io import StringIO
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import threading
 from decimal import *
 
-from .models import User, Listing, Bid, Comment, Category
-
-class PersistentSessionClient(Client):
-	""" utility class to be able use persistent data in test sessions"""
-	@property
-	def session(self):
-		if not hasattr(self, "_persisted_session"):
-			engine = import_module(settings.SESSION_ENGINE)
-			self._persisted_session = engine.SessionStore("persistent")
-		return self._persisted_session
+from . import admin, benchmark, bid_history, bidding, category_counts, checks, datagen, fragments, metrics, search
+from .pubsub import LocalBroker
+from .streams import with_listing_events
+from .bidding import BidRejected, BidUndecided, close_due_auctions, close_listing, place_bid
+from .forms import ListingForm
+from .auction_state import AuctionStates, LocalInvalidation, SharedCacheInvalidation, get_states
+from .importer import import_listings, read_rows
+from .ingest import BidQueue, PendingBid, take_bid, write_batch
+from .models import User, Listing, Bid, Comment, Category, WatchlistEntry
+
+class QueryBudgetMixin:
+	""" lets a test fail when a block of code runs more queries than allowed"""
+	@contextmanager
+	def assertMaxQueries(self, maximum):
+		with CaptureQueriesContext(connection) as queries:
+			yield queries
+		self.assertLessEqual(len(queries), maximum,
+			"\n".join(query["sql"] for query in queries.captured_queries))
 
 class ModelTests(TestCase):
 
@@ -35,6 +62,10 @@ class ModelTests(TestCase):
 		
 		cls.BID_AMOUNT = Decimal(2321.34).quantize(Decimal("0.01"))
 		cls.bid = Bid.objects.create(amount=cls.BID_AMOUNT, listing=cls.cloak, owner=cls.mike)
+
+	def setUp(self):
+		# bids made in other tests update the shared listing object in memory
+		self.cloak.refresh_from_db()
 		
 	def test_category_created_well(self):
 		""" check that a category is created well"""
@@ -76,6 +107,90 @@ class ModelTests(TestCase):
 		# no new bids are linked to item
 		self.assertIsNone(item.highestBidder())
 
+	def test_bid_updates_listing_state(self):
+		""" ensure that saving bids keeps the stored price, count and leader in step"""
+		low_amount = Decimal(100).quantize(Decimal("0.01"))
+		high_amount = Decimal(5000).quantize(Decimal("0.01"))
+
+		Bid.objects.create(amount=low_amount, owner=self.joe, listing=self.cloak)
+		high_bid = Bid.objects.create(amount=high_amount, owner=self.joe, listing=self.cloak)
+
+		listing = Listing.objects.get(pk=self.cloak.pk)
+		self.assertEqual(high_amount, listing.currentPrice)
+		self.assertEqual(3, listing.bidCount)
+		self.assertEqual(high_bid, listing.highestBid())
+		self.assertEqual(self.joe, listing.highestBidder())
+
+	def test_highest_bid_with_shared_top_price(self):
+		""" ensure that two listings topping out at the same price each find their own bid"""
+		item = Listing.objects.create(title="wand", seller=self.mike, initialPrice=Decimal("1.00"),
+					description="elder wand", isActive=True, category=self.games)
+		same_bid = Bid.objects.create(amount=self.BID_AMOUNT, owner=self.joe, listing=item)
+
+		self.assertEqual(self.bid, Listing.objects.get(pk=self.cloak.pk).highestBid())
+		self.assertEqual(same_bid, Listing.objects.get(pk=item.pk).highestBid())
+		self.assertEqual(self.bid, self.cloak.topBid())
+		self.assertEqual(same_bid, item.topBid())
+
+	def test_new_listing_current_price_is_start_price(self):
+		""" ensure that a listing without bids is priced at its start price"""
+		item = Listing.objects.create(title="boots", seller=self.mike, initialPrice=Decimal("12.50"),
+					description="seven league boots", isActive=True, category=self.games)
+
+		item.refresh_from_db()
+		self.assertEqual(Decimal("12.50"), item.currentPrice)
+		self.assertEqual(0, item.bidCount)
+
+	def test_editing_a_listing_keeps_bids_committed_since_it_was_loaded(self):
+		""" ensure that saving an edited listing doesn't write back the bid state it was loaded with"""
+		edited = Listing.objects.get(pk=self.cloak.pk)
+		bid = Bid.objects.create(amount=Decimal("3000.00"), owner=self.joe, listing=self.cloak)
+		edited.title = "visible_cloak"
+		edited.save()
+
+		listing = Listing.objects.get(pk=self.cloak.pk)
+		self.assertEqual(("visible_cloak", Decimal("3000.00"), 2, bid.id),
+			(listing.title, listing.currentPrice, listing.bidCount, listing.leadingBid_id))
+
+		item = Listing.objects.create(title="boots", seller=self.mike, initialPrice=Decimal("12.50"),
+					description="seven league boots", isActive=True, category=self.games)
+		item.initialPrice = Decimal("8.00")
+		item.save()
+		self.assertEqual(Decimal("8.00"), Listing.objects.get(pk=item.pk).currentPrice)
+
+	def test_deleting_bids_repairs_the_listing(self):
+		""" ensure that deleting a bid, also through its owner, recomputes the listing's state"""
+		bidder = User.objects.create_user(username="fleeting")
+		Bid.objects.create(amount=Decimal("3000.00"), owner=bidder, listing=self.cloak)
+		with self.captureOnCommitCallbacks(execute=True):
+			bidder.delete()
+
+		listing = Listing.objects.get(pk=self.cloak.pk)
+		self.assertEqual((self.BID_AMOUNT, 1, self.bid.id), (listing.currentPrice, listing.bidCount, listing.leadingBid_id))
+		self.assertFalse(listing.isValidBid(Decimal("6.00")))
+
+	def test_refresh_bid_stats_command_repairs_drift(self):
+		""" ensure that the refresh command rebuilds a listing's stored auction state"""
+		Listing.objects.filter(pk=self.cloak.pk).update(currentPrice=1, bidCount=0, leadingBid=None,
+			leadingBidder=None)
+
+		out = StringIO()
+		call_command("refresh_bid_stats", stdout=out)
+
+		listing = Listing.objects.get(pk=self.cloak.pk)
+		self.assertEqual(self.BID_AMOUNT, listing.currentPrice)
+		self.assertEqual(1, listing.bidCount)
+		self.assertEqual(self.bid, listing.leadingBid)
+		self.assertEqual(self.mike, listing.leadingBidder)
+		self.assertIn("repaired 1", out.getvalue())
+
+	def test_refresh_bid_stats_locks_the_listing(self):
+		""" ensure that a repair takes the listing's write lock, so a bid can't commit under it"""
+		with mock.patch.object(bidding, "lock_for_writing", wraps=bidding.lock_for_writing) as lock:
+			self.assertFalse(bidding.refresh_bid_stats(self.cloak.pk))
+		lock.assert_called_once_with([self.cloak.pk])
+		self.assertFalse(bidding.refresh_bid_stats(0))
+
 	def test_bid_created_well(self):
 		""" check that a bid is created well"""
 		self.assertIsInstance(self.bid, Bid)
@@ -175,12 +290,31 @@ class MainViewsTests(TestCase):
 		# ensure that the correct listings are sent
 		self.assertEqual(len(Listing.objects.all()), len(response.context["listings"]))
 
-	def test_index_route_watchlist_created_when_logged_in(self):
+	@override_settings(LISTINGS_PAGE_SIZE=1)
+	def test_index_route_pages_with_cursor(self):
+		""" ensure that the index is paged newest first and the cursor walks to the end"""
+		newest, oldest = Listing.objects.order_by("-id")
+
+		response = self.client.get(reverse("index"))
+		self.assertEqual([newest], response.context["listings"])
+		self.assertEqual(newest.id, response.context["next_cursor"])
+
+		response = self.client.get(reverse("index"), data={"cursor":response.context["next_cursor"]})
+		self.assertEqual([oldest], response.context["listings"])
+		self.assertIsNone(response.context["next_cursor"])
+
+	def test_index_route_invalid_cursor(self):
+		""" ensure that a cursor that isn't an id renders an error"""
+		response = self.client.get(reverse("index"), data={"cursor":"abc"})
+
+		self.assertTemplateUsed(response, template_name="auctions/errors.html")
+
+	def test_index_route_watchlist_not_in_session_when_logged_in(self):
 		self.client.force_login(self.user)
 		response = self.client.get(reverse("index"))
 
-		# ensure that a watch list was created for the user
-		self.assertIn("watchlist", self.client.session)
+		# ensure that the watchlist is no longer kept in the session
+		self.assertNotIn("watchlist", self.client.session)
 	
 	def test_index_route_watchlist_not_created_when_not_logged_in(self):
 		response = self.client.get(reverse("index"))
@@ -245,6 +379,14 @@ class MainViewsTests(TestCase):
 		# ensure that the correct listings are sent
 		self.assertEqual(2, len(response.context["listings"]))
 
+	@override_settings(LISTINGS_PAGE_SIZE=1)
+	def test_category_listings_route_pages_with_cursor(self):
+		""" ensure that the category listings are paged"""
+		response = self.client.get(reverse("category_listings", args=[self.category.name]))
+
+		self.assertEqual(1, len(response.context["listings"]))
+		self.assertIsNotNone(response.context["next_cursor"])
+
 	def test_category_listing_route_invalid_category(self):
 		""" test to ensure that an invalid category to the route results in a 
 			error 
@@ -257,27 +399,22 @@ class MainViewsTests(TestCase):
 		self.assertTemplateUsed(response, template_name="auctions/errors.html")
 
 	def test_watchlist_route_displays(self):
-		client = PersistentSessionClient()
-		client.force_login(self.user)
-		client.session["watchlist"] = []
-		client.session.save()
-		response = client.get(reverse("show_watchlist"))
+		self.client.force_login(self.user)
+		response = self.client.get(reverse("show_watchlist"))
 
 		self.assertEqual(200, response.status_code)
 		self.assertTemplateUsed(response, template_name="auctions/watchlist.html")
 
 	def test_watchlist_route_returns_user_listings(self):
 		""" ensure that the the correct watchlist listings are returned"""
-		# using an extended client object in order to be able to manipulate sessions
-		client = PersistentSessionClient()
-		client.force_login(self.user)
+		self.client.force_login(self.user)
 
 		listings = list(Listing.objects.all().values_list("pk", flat=True))
-		client.session["watchlist"] = listings
-		client.session.save()
-		response = client.get(reverse("show_watchlist"))
+		for listing_id in listings:
+			WatchlistEntry.objects.create(user=self.user, listing_id=listing_id)
+		response = self.client.get(reverse("show_watchlist"))
 		
-		# check that the listings returned are the listings in the session
+		# check that the listings returned are the listings in the watchlist
 		
 		self.assertEqual(len(listings), len(response.context["listings"]))
 
@@ -288,16 +425,26 @@ class MainViewsTests(TestCase):
 
 	def test_add_or_remove_from_watchlist_route_add(self):
 		""" ensure that a listing is added to a watchlist """		
-		client = PersistentSessionClient()
-		client.force_login(self.user)
+		self.client.force_login(self.user)
 
-		client.session["watchlist"] = []
-		client.session.save()
-		response = client.get(reverse("edit_watchlist"), data={"action":"add", 
+		response = self.client.get(reverse("edit_watchlist"), data={"action":"add", 
 			"listing_id":1
 			})
 		self.assertJSONEqual(str(response.content, encoding="utf8"),
 				 {"success":True})
+		self.assertTrue(self.user.watchlist.filter(listing_id=1).exists())
+
+	def test_add_or_remove_from_watchlist_route_delete(self):
+		""" ensure that a listing is removed from a watchlist """
+		self.client.force_login(self.user)
+		WatchlistEntry.objects.create(user=self.user, listing_id=1)
+
+		response = self.client.get(reverse("edit_watchlist"), data={"action":"delete",
+			"listing_id":1
+			})
+		self.assertJSONEqual(str(response.content, encoding="utf8"),
+				 {"success":True})
+		self.assertFalse(self.user.watchlist.exists())
 
 	def test_add_or_remove_from_watchlist_route_failure(self):
 		""" ensure that the route fails when given wrong arguements"""
@@ -309,11 +456,10 @@ class MainViewsTests(TestCase):
 	
 	def test_in_watchlist_route_true_if_listing_is_in_watchlist(self):
 		""" ensure that if a listing is in a user watchlist, it returns true"""
-		client = PersistentSessionClient()
+		client = self.client
 		client.force_login(self.user)
 
-		client.session["watchlist"] = [1]
-		client.session.save()
+		WatchlistEntry.objects.create(user=self.user, listing_id=1)
 
 		IS_LISTING_IN_WATCHLIST = True
 		response = client.get(reverse("in_watchlist"), data={"listing_id":1})
@@ -323,11 +469,10 @@ class MainViewsTests(TestCase):
 
 	def test_in_watchlist_route_false_if_lisiting_not_in_watchlist(self):
 		""" ensure that if a listing is in a user watchlist, it returns true"""
-		client = PersistentSessionClient()
+		client = self.client
 		client.force_login(self.user)
 
-		client.session["watchlist"] = [2]
-		client.session.save()
+		WatchlistEntry.objects.create(user=self.user, listing_id=2)
 
 		IS_LISTING_IN_WATCHLIST = False
 		#listing id of 21 is not in watchlist
@@ -337,13 +482,41 @@ class MainViewsTests(TestCase):
 			{"in_watchlist": IS_LISTING_IN_WATCHLIST, "success":True
 		})
 
+	def test_watchlist_status_route_answers_for_many_listings(self):
+		""" ensure that the bulk status route reports every listing asked about"""
+		self.client.force_login(self.user)
+		WatchlistEntry.objects.create(user=self.user, listing_id=1)
+
+		with self.assertNumQueries(3):
+			response = self.client.get(reverse("watchlist_status"), data={"listing_ids":"1,2,21"})
+		self.assertJSONEqual(str(response.content, encoding="utf8"),
+			{"success":True, "in_watchlist":{"1":True, "2":False, "21":False}})
+
+	def test_watchlist_status_route_invalid_arguments(self):
+		""" ensure that bad listing ids are refused"""
+		self.client.force_login(self.user)
+
+		response = self.client.get(reverse("watchlist_status"), data={"listing_ids":"1,abc"})
+		self.assertFalse(response.json()["success"])
+
+	def test_feeds_and_listing_page_embed_watchlist_state(self):
+		""" ensure that pages render with the user's watchlist state already in them"""
+		self.client.force_login(self.user)
+		WatchlistEntry.objects.create(user=self.user, listing_id=1)
+
+		response = self.client.get(reverse("index"))
+		self.assertEqual({1}, response.context["watched_ids"])
+
+		listing = Listing.objects.get(id=1)
+		response = self.client.get(reverse("single_listing", args=[listing.title]), data={"id":1})
+		self.assertTrue(response.context["is_in_watchlist"])
+
 	def test_in_watchlist_route_expected_response_on_failure(self):
 		""" ensure that if a listing is in a user watchlist, it returns true"""
-		client = PersistentSessionClient()
+		client = self.client
 		client.force_login(self.user)
 
-		client.session["watchlist"] = [1]
-		client.session.save()
+		WatchlistEntry.objects.create(user=self.user, listing_id=1)
 
 		IS_LISTING_IN_WATCHLIST = True
 		response = client.get(reverse("in_watchlist"), data={"listing_id":"invalid response"
@@ -506,3 +679,1366 @@ class MainViewsTests(TestCase):
 		self.assertEqual(200, response.status_code)
 		self.assertTemplateUsed(response, template_name="auctions/errors.html")
 
+
+
+class BidPlacementTests(TransactionTestCase):
+
+	def setUp(self):
+		self.seller = User.objects.create_user(username="seller", password="sellsellsell")
+		self.bidders = [User.objects.create_user(username=f"bidder{i}", password="bidbidbid")
+			for i in range(10)]
+		self.listing = Listing.objects.create(title="lamp", seller=self.seller, initialPrice=Decimal("1.00"),
+					description="a magic lamp", isActive=True, category=Category.objects.create(name="lamps"))
+
+	def test_place_bid_rejects_low_and_closed(self):
+		""" ensure that bids under the current price and bids on closed listings are refused"""
+		place_bid(self.listing.id, self.bidders[0], Decimal("5.00"))
+
+		with self.assertRaises(BidRejected):
+			place_bid(self.listing.id, self.bidders[1], Decimal("5.00"))
+
+		Listing.objects.filter(pk=self.listing.id).update(isActive=False)
+		with self.assertRaises(BidRejected):
+			place_bid(self.listing.id, self.bidders[1], Decimal("50.00"))
+
+	# the in memory test database locks whole tables and never waits for them
+	@override_settings(BID_RETRY_ATTEMPTS=50)
+	def test_concurrent_bids_have_one_winner_per_price(self):
+		""" fire thousands of bids from several threads and ensure no price level is won twice"""
+		LEVELS, BIDS_PER_LEVEL, THREADS = 100, 20, 8
+		bids = [(Decimal(level), self.bidders[i % len(self.bidders)])
+			for level in range(1, LEVELS + 1) for i in range(BIDS_PER_LEVEL)]
+		random.Random(7).shuffle(bids)
+
+		errors = []
+
+		def bid_on(share):
+			try:
+				for amount, bidder in share:
+					try:
+						place_bid(self.listing.id, bidder, amount)
+					except BidRejected:
+						pass
+			except Exception as error:
+				errors.append(error)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=bid_on, args=(bids[i::THREADS],)) for i in range(THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual([], errors)
+		accepted = list(Bid.objects.filter(listing=self.listing).order_by("id").values_list("amount", flat=True))
+		duplicates = Bid.objects.values("amount").annotate(n=Count("id")).filter(n__gt=1)
+
+		self.assertFalse(duplicates.exists())
+		self.assertEqual(sorted(accepted), accepted)
+		self.assertEqual(Decimal(LEVELS), accepted[-1])
+
+		listing = Listing.objects.get(pk=self.listing.id)
+		self.assertEqual(Decimal(LEVELS), listing.currentPrice)
+		self.assertEqual(len(accepted), listing.bidCount)
+
+
+class BidIngestionTests(TransactionTestCase):
+	# the bid writer has its own thread and connection
+
+	def setUp(self):
+		self.seller = User.objects.create_user(username="seller", password="sellsellsell")
+		self.bidders = [User.objects.create_user(username=f"bidder{i}", password="bidbidbid")
+			for i in range(4)]
+		self.listing = Listing.objects.create(title="lamp", seller=self.seller, initialPrice=Decimal("3.00"),
+					description="a magic lamp", isActive=True, category=Category.objects.create(name="lamps"))
+		self.queue = BidQueue()
+
+	def tearDown(self):
+		self.queue.stop()
+
+	def test_batch_decides_bids_in_arrival_order(self):
+		""" ensure that each bid of a batch is checked against the price the bids before it left"""
+		closed = Listing.objects.create(title="rug", seller=self.seller, initialPrice=Decimal("1.00"),
+					description="a rug", isActive=False, category_id="lamps")
+		batch = [PendingBid(self.listing.id, self.bidders[0], Decimal("5.00")),
+			PendingBid(self.listing.id, self.bidders[1], Decimal("4.00")),
+			PendingBid(closed.id, self.bidders[1], Decimal("9.00")),
+			PendingBid(999, self.bidders[1], Decimal("9.00")),
+			PendingBid(self.listing.id, self.bidders[2], Decimal("6.00"))]
+
+		outcomes = write_batch(batch)
+
+		self.assertEqual([Bid, BidRejected, BidRejected, BidRejected, Bid], [type(outcome) for outcome in outcomes])
+		listing = Listing.objects.get(pk=self.listing.id)
+		self.assertEqual((Decimal("6.00"), 2, outcomes[-1].id, self.bidders[2].id),
+			(listing.currentPrice, listing.bidCount, listing.leadingBid_id, listing.leadingBidder_id))
+
+	def test_queue_resolves_futures(self):
+		""" ensure that every submitter learns whether its queued bid was taken"""
+		futures = [self.queue.submit(self.listing.id, bidder, amount)
+			for bidder, amount in zip(self.bidders, [Decimal("5.00"), Decimal("5.00"), Decimal("7.00")])]
+
+		self.assertEqual(Decimal("5.00"), futures[0].result(5).amount)
+		with self.assertRaises(BidRejected):
+			futures[1].result(5)
+		self.assertEqual(self.bidders[2].id, futures[2].result(5).owner_id)
+		self.assertEqual(2, Bid.objects.filter(listing=self.listing).count())
+
+	def test_concurrent_queued_bids_keep_the_listing_consistent(self):
+		""" ensure that bids queued from several threads leave the stored state matching the bids"""
+		bids = [(Decimal(level), self.bidders[level % len(self.bidders)]) for level in range(4, 200)]
+		random.Random(3).shuffle(bids)
+		errors = []
+
+		def bid_on(share):
+			try:
+				for amount, bidder in share:
+					try:
+						self.queue.submit(self.listing.id, bidder, amount).result(10)
+					except BidRejected:
+						pass
+			except Exception as error:
+				errors.append(error)
+
+		threads = [threading.Thread(target=bid_on, args=(bids[i::8],)) for i in range(8)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		self.assertEqual([], errors)
+		accepted = list(Bid.objects.filter(listing=self.listing).order_by("id").values_list("amount", flat=True))
+		listing = Listing.objects.get(pk=self.listing.id)
+		self.assertEqual(sorted(set(accepted)), accepted)
+		self.assertEqual((Decimal(199), len(accepted)), (listing.currentPrice, listing.bidCount))
+
+	def test_writer_survives_a_failed_connection_check(self):
+		""" ensure that an error before a batch is written fails only that batch's bids"""
+		from . import ingest
+		with mock.patch.object(ingest, "close_old_connections", side_effect=[RuntimeError("gone"), None]):
+			with self.assertRaises(RuntimeError):
+				self.queue.submit(self.listing.id, self.bidders[0], Decimal("5.00")).result(5)
+			self.assertEqual(Decimal("6.00"), self.queue.submit(self.listing.id, self.bidders[0],
+				Decimal("6.00")).result(5).amount)
+
+	@override_settings(BID_INGESTION="queue", BID_QUEUE_TIMEOUT=0.01)
+	def test_undecided_bid_is_reported(self):
+		""" ensure that a bid the writer hasn't decided in time is reported as undecided, not an error"""
+		self.client.force_login(self.bidders[0])
+		with mock.patch.object(BidQueue, "submit", return_value=Future()):
+			with self.assertRaises(BidUndecided):
+				take_bid(self.listing.id, self.bidders[0], Decimal("5.00"))
+			response = self.client.post(reverse("make_bid", args=[self.listing.id]), {"bid":"5.00"})
+
+		self.assertContains(response, "may still be taken")
+
+	@override_settings(BID_INGESTION="queue")
+	def test_make_bid_through_the_queue(self):
+		""" ensure that make_bid waits for its queued bid and redirects to the listing"""
+		from . import ingest
+		self.addCleanup(ingest.get_queue().stop)
+		self.client.force_login(self.bidders[0])
+
+		response = self.client.post(reverse("make_bid", args=[self.listing.id]), {"bid":"8.50"})
+
+		self.assertRedirects(response, reverse("single_listing", args=["lamp"]) + f"?id={self.listing.id}",
+			fetch_redirect_response=False)
+		self.assertEqual(Decimal("8.50"), Listing.objects.get(pk=self.listing.id).currentPrice)
+
+
+class AuctionStateTests(QueryBudgetMixin, TransactionTestCase):
+	# the states only keep what has been committed
+
+	def setUp(self):
+		self.seller = User.objects.create_user(username="seller", password="sellsellsell")
+		self.bidder = User.objects.create_user(username="bidder", password="bidbidbid")
+		self.category = Category.objects.create(name="lamps")
+		self.listing = self.make_listing("lamp")
+		get_states().clear()
+
+	def make_listing(self, title):
+		return Listing.objects.create(title=title, seller=self.seller, initialPrice=Decimal("3.00"),
+					description="a lamp", isActive=True, category=self.category)
+
+	def test_low_bids_are_rejected_without_sql(self):
+		""" ensure that once a bid is taken, bids under it are turned away from memory"""
+		take_bid(self.listing.id, self.bidder, Decimal("5.00"))
+
+		with self.assertMaxQueries(0):
+			for amount in ("1.00", "5.00"):
+				with self.assertRaises(BidRejected):
+					take_bid(self.listing.id, self.bidder, Decimal(amount))
+
+		take_bid(self.listing.id, self.bidder, Decimal("6.00"))
+		self.assertEqual(Decimal("6.00"), get_states().get(self.listing.id).currentPrice)
+
+	def test_closed_listings_are_rejected_without_sql(self):
+		""" ensure that a close is kept, and a reopened listing takes bids again"""
+		close_listing(self.listing.id, self.seller)
+		with self.assertMaxQueries(0):
+			with self.assertRaises(BidRejected):
+				take_bid(self.listing.id, self.bidder, Decimal("50.00"))
+
+		listing = Listing.objects.get(pk=self.listing.id)
+		listing.isActive = True
+		listing.save()
+		self.assertEqual(Decimal("50.00"), take_bid(self.listing.id, self.bidder, Decimal("50.00")).amount)
+
+	def test_deleted_bids_are_not_held_against_new_ones(self):
+		""" ensure that deleting the leading bid drops the cached state it set"""
+		bid = take_bid(self.listing.id, self.bidder, Decimal("5.00"))
+		bid.delete()
+
+		self.assertEqual(Decimal("4.00"), take_bid(self.listing.id, self.bidder, Decimal("4.00")).amount)
+
+	def test_changes_that_accept_more_bids_are_not_ruled_out(self):
+		""" ensure that an end time or initial price another process changed isn't held against a bid"""
+		Listing.objects.filter(pk=self.listing.id).update(endsAt=timezone.now() - timedelta(minutes=1))
+		with self.assertRaises(BidRejected):
+			take_bid(self.listing.id, self.bidder, Decimal("4.00"))
+
+		# changed without this process hearing of it
+		Listing.objects.filter(pk=self.listing.id).update(endsAt=timezone.now() + timedelta(days=1),
+			initialPrice=Decimal("1.00"))
+		self.assertEqual(Decimal("2.00"), take_bid(self.listing.id, self.bidder, Decimal("2.00")).amount)
+
+	def test_warm_loads_newest_active_listings_in_one_query(self):
+		""" ensure that warming is one query bounded by the size, least recently used going first"""
+		newer = self.make_listing("newer")
+		newest = self.make_listing("newest")
+		states = AuctionStates(2, LocalInvalidation())
+
+		with self.assertMaxQueries(1):
+			states.warm()
+		with self.assertMaxQueries(0):
+			states.get(newer.id)
+			states.get(newest.id)
+
+		states.get(self.listing.id)
+		self.assertEqual(2, len(states))
+		with self.assertMaxQueries(0):
+			states.get(newest.id)
+
+	def test_nothing_read_in_a_transaction_is_kept(self):
+		""" ensure that a state read inside a transaction, which could roll back, isn't cached"""
+		states = AuctionStates(10, LocalInvalidation())
+		with transaction.atomic():
+			self.assertTrue(states.get(self.listing.id).isActive)
+		self.assertEqual(0, len(states))
+
+	def test_shared_invalidation_reaches_other_processes(self):
+		""" ensure that a change recorded by one process's states makes another's reload"""
+		here, there = AuctionStates(10, SharedCacheInvalidation()), AuctionStates(10, SharedCacheInvalidation())
+		there.get(self.listing.id)
+		with self.assertMaxQueries(0):
+			there.get(self.listing.id)
+
+		Listing.objects.filter(pk=self.listing.id).update(currentPrice=Decimal("9.00"))
+		here.changed([self.listing.id])
+		with self.assertMaxQueries(1):
+			self.assertEqual(Decimal("9.00"), there.get(self.listing.id).currentPrice)
+
+	@override_settings(AUCTION_STATE_INVALIDATION="auctions.auction_state.SharedCacheInvalidation")
+	def test_shared_invalidation_needs_a_shared_cache(self):
+		""" ensure that shared invalidation is refused on a cache each process has its own of"""
+		self.assertEqual(["auctions.E002"], [error.id for error in checks.check_state_invalidation(None)])
+		with self.settings(CACHES={"default":{"BACKEND":"django.core.cache.backends.memcached.PyMemcacheCache"}}):
+			self.assertEqual([], checks.check_state_invalidation(None))
+
+
+class QueryPlanTests(QueryBudgetMixin, TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="planner", password="plansplansplans")
+		cls.category = Category.objects.create(name="plans")
+		cls.listing = cls.add_listings(1)[0]
+
+	@classmethod
+	def add_listings(cls, count):
+		return [Listing.objects.create(title=f"plan{i}", seller=cls.user, initialPrice=Decimal("1.00"),
+					description="a plan", isActive=True, category=cls.category) for i in range(count)]
+
+	def add_comments(self, count):
+		commenters = [User.objects.create_user(username=f"commenter{Comment.objects.count()}_{i}")
+			for i in range(count)]
+		for commenter in commenters:
+			Comment.objects.create(comment="nice", commenter=commenter, listing=self.listing)
+
+	def page_queries(self, url, data=None, maximum=5):
+		with self.assertMaxQueries(maximum) as queries:
+			response = self.client.get(url, data=data)
+		self.assertEqual(200, response.status_code)
+		return len(queries)
+
+	def test_listing_feeds_have_constant_query_count(self):
+		""" ensure that the feeds don't run a query per listing"""
+		urls = [reverse("index"), reverse("category_listings", args=[self.category.name])]
+		before = [self.page_queries(url) for url in urls]
+		self.add_listings(10)
+		after = [self.page_queries(url) for url in urls]
+
+		self.assertEqual(before, after)
+
+	def test_single_listing_has_constant_query_count(self):
+		""" ensure that the detail page doesn't run a query per comment"""
+		url = reverse("single_listing", args=[self.listing.title])
+		self.add_comments(1)
+		before = self.page_queries(url, {"id":self.listing.id})
+		self.add_comments(10)
+		after = self.page_queries(url, {"id":self.listing.id})
+
+		self.assertEqual(before, after)
+
+
+class CardCacheTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="cacher", password="cachecachecache")
+		cls.category = Category.objects.create(name="cached")
+		cls.listing = Listing.objects.create(title="urn", seller=cls.user, initialPrice=Decimal("3.00"),
+					description="an urn", isActive=True, category=cls.category)
+
+	def setUp(self):
+		self.listing.refresh_from_db()
+		fragments.get_cache().clear()
+		fragments.reset_stats()
+
+	def test_cards_are_served_from_cache(self):
+		""" ensure that the second render of a feed only hits the cache"""
+		self.client.get(reverse("index"))
+		self.client.get(reverse("index"))
+
+		self.assertEqual({"hits":1, "misses":1, "ratio":0.5}, fragments.stats())
+
+	def test_bid_invalidates_card(self):
+		""" ensure that a new bid re-renders the card with the new price"""
+		self.client.get(reverse("index"))
+		Bid.objects.create(amount=Decimal("75.25"), owner=self.user, listing=self.listing)
+		response = self.client.get(reverse("index"))
+
+		self.assertEqual(2, fragments.stats()["misses"])
+		self.assertContains(response, "75.25")
+
+	def test_listing_save_invalidates_card(self):
+		""" ensure that editing a listing re-renders its card"""
+		self.client.get(reverse("index"))
+		self.listing.title = "vase"
+		self.listing.save()
+		response = self.client.get(reverse("index"))
+
+		self.assertEqual(2, fragments.stats()["misses"])
+		self.assertContains(response, "vase")
+
+	@override_settings(CACHES={"default":{"BACKEND":"django.core.cache.backends.db.DatabaseCache",
+		"LOCATION":"card_cache"}})
+	def test_feeds_with_a_database_cache(self):
+		""" ensure that the async feeds read cards from a cache that queries in their thread"""
+		call_command("createcachetable")
+		urls = [reverse("index"), reverse("category_listings", args=[self.category.name])]
+		for url in urls * 2:
+			self.assertContains(self.client.get(url), "urn")
+		self.assertEqual(3, fragments.stats()["hits"])
+
+	def test_card_cache_stats_is_staff_only(self):
+		""" ensure that only staff can read the cache counters"""
+		self.client.force_login(self.user)
+		self.assertEqual(403, self.client.get(reverse("card_cache_stats")).status_code)
+
+		User.objects.filter(pk=self.user.pk).update(is_staff=True)
+		response = self.client.get(reverse("card_cache_stats"))
+		self.assertTrue(response.json()["success"])
+
+
+class SearchTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="seeker", password="seekseekseek")
+		cls.books = Category.objects.create(name="books")
+		cls.toys = Category.objects.create(name="toys")
+		cls.atlas = Listing.objects.create(title="old atlas", seller=cls.user, initialPrice=Decimal("9.00"),
+					description="maps of the known world", isActive=True, category=cls.books)
+		cls.globe = Listing.objects.create(title="spinning globe", seller=cls.user, initialPrice=Decimal("19.00"),
+					description="a world atlas you can spin", isActive=True, category=cls.toys)
+
+	def titles(self, **params):
+		response = self.client.get(reverse("search"), data=params)
+		self.assertEqual(200, response.status_code)
+		return [listing.title for listing in response.context["listings"]]
+
+	def test_search_ranks_title_matches_first(self):
+		""" ensure that a listing with the word in its title outranks one with it in the description"""
+		self.assertEqual(["old atlas", "spinning globe"], self.titles(q="atlas"))
+
+	def test_search_matches_prefixes_and_ignores_fts_syntax(self):
+		""" ensure that words match as prefixes and operators typed by users are harmless"""
+		self.assertEqual(["spinning globe"], self.titles(q="spin"))
+		self.assertEqual(["old atlas"], self.titles(q='"maps* (('))
+
+	def test_search_filters_by_category_and_activity(self):
+		""" ensure that the category and closed filters are applied"""
+		self.assertEqual(["spinning globe"], self.titles(q="atlas", category="toys"))
+
+		Listing.objects.filter(pk=self.atlas.pk).update(isActive=False)
+		self.assertEqual(["spinning globe"], self.titles(q="atlas"))
+		self.assertEqual(["old atlas", "spinning globe"], self.titles(q="atlas", closed="1"))
+
+	def test_search_index_follows_edits(self):
+		""" ensure that the triggers keep the index in step with the listings table"""
+		Listing.objects.filter(pk=self.globe.pk).update(title="spinning top", description="a toy")
+
+		self.assertEqual(["old atlas"], self.titles(q="atlas"))
+		self.assertEqual(["spinning top"], self.titles(q="top"))
+
+	def test_rebuild_search_index_command(self):
+		""" ensure that the rebuild command restores a dropped trigger and reindexes"""
+		with connection.cursor() as cursor:
+			cursor.execute(f"DROP TRIGGER {search.FTS_TABLE}_insert")
+		Listing.objects.create(title="pocket atlas", seller=self.user, initialPrice=Decimal("2.00"),
+					description="small maps", isActive=True, category=self.books)
+
+		out = StringIO()
+		call_command("rebuild_search_index", stdout=out)
+		self.assertIn("pocket atlas", self.titles(q="pocket"))
+
+
+class LiveUpdateTests(TransactionTestCase):
+	# the streams read listings from a worker thread with its own connection
+
+	def setUp(self):
+		self.user = User.objects.create_user(username="watcher", password="watchwatchwatch")
+		self.listing = Listing.objects.create(title="clock", seller=self.user, initialPrice=Decimal("4.00"),
+					description="a cuckoo clock", isActive=True, category=Category.objects.create(name="clocks"))
+
+	def test_local_broker_fans_out_across_threads(self):
+		""" ensure that every subscriber gets messages published from another thread"""
+		broker = LocalBroker()
+
+		async def listen():
+			async with broker.subscribe("c") as first, broker.subscribe("c") as second:
+				thread = threading.Thread(target=broker.publish, args=("c", {"n":1}))
+				thread.start()
+				received = [await asyncio.wait_for(first.get(), 1), await asyncio.wait_for(second.get(), 1)]
+			thread.join()
+			return received
+
+		self.assertEqual([{"n":1}, {"n":1}], async_to_sync(listen)())
+		self.assertFalse(broker.has_subscribers("c"))
+
+	def test_listing_events_stream_bids_until_closed(self):
+		""" ensure that the event stream sends the current state, each new bid and the close"""
+		# both publish once their transaction commits
+		def bid():
+			Bid.objects.create(amount=Decimal("6.50"), owner=self.user, listing=self.listing)
+
+		def close():
+			close_listing(self.listing.id, self.user)
+
+		async def stream():
+			app = ApplicationCommunicator(with_listing_events(None),
+				{"type":"http", "method":"GET", "path":f"/listings/{self.listing.id}/events",
+				"headers":[(b"host", b"localhost")]})
+			await app.send_input({"type":"http.request"})
+			start = await app.receive_output(1)
+			bodies = [await app.receive_output(1)]
+			await sync_to_async(bid, thread_sensitive=True)()
+			bodies.append(await app.receive_output(1))
+			await sync_to_async(close, thread_sensitive=True)()
+			bodies.append(await app.receive_output(1))
+			bodies.append(await app.receive_output(1))
+			return start, bodies
+
+		start, bodies = async_to_sync(stream)()
+		events = [json.loads(body["body"].decode()[len("data: "):]) for body in bodies[:3]]
+
+		self.assertEqual(200, start["status"])
+		self.assertEqual(["4.00", "6.50", "6.50"], [event["price"] for event in events])
+		self.assertEqual([0, 1, 1], [event["bids"] for event in events])
+		self.assertFalse(events[2]["active"])
+		self.assertFalse(bodies[3].get("more_body", False))
+
+	def test_listing_events_unknown_listing(self):
+		""" ensure that a stream for a listing that doesn't exist is a 404"""
+		async def stream():
+			app = ApplicationCommunicator(with_listing_events(None),
+				{"type":"http", "method":"GET", "path":"/listings/999/events",
+				"headers":[(b"host", b"localhost")]})
+			await app.send_input({"type":"http.request"})
+			return await app.receive_output(1)
+
+		from . import streams
+		with mock.patch.object(streams, "close_old_connections") as close:
+			self.assertEqual(404, async_to_sync(stream)()["status"])
+		# the stream's thread checks its connection the way a request would
+		self.assertEqual(2, close.call_count)
+
+	def test_listing_events_only_stream_allowed_gets(self):
+		""" ensure that other methods and hosts outside ALLOWED_HOSTS are left to django"""
+		django_application = mock.AsyncMock()
+		path = f"/listings/{self.listing.id}/events"
+
+		async def request(method, host):
+			await with_listing_events(django_application)({"type":"http", "method":method, "path":path,
+				"headers":[(b"host", host)]}, None, None)
+
+		async_to_sync(request)("POST", b"localhost")
+		async_to_sync(request)("GET", b"evil.example")
+		self.assertEqual(2, django_application.await_count)
+
+	def test_listing_events_url_under_wsgi(self):
+		""" ensure that django answers the stream url with a 204 so EventSource gives up"""
+		response = self.client.get(reverse("listing_events", args=[self.listing.id]))
+		self.assertEqual(204, response.status_code)
+
+
+class AuctionEndTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.seller = User.objects.create_user(username="auctioneer", password="goinggoinggone")
+		cls.bidder = User.objects.create_user(username="collector", password="collectcollect")
+		cls.category = Category.objects.create(name="antiques")
+
+	def add_listing(self, endsAt):
+		return Listing.objects.create(title="chair", seller=self.seller, initialPrice=Decimal("10.00"),
+					description="a rocking chair", isActive=True, category=self.category, endsAt=endsAt)
+
+	def test_due_auctions_are_closed_with_their_winner(self):
+		""" ensure that the scheduler closes ended listings only and records who won"""
+		now = timezone.now()
+		ended = self.add_listing(now - timedelta(minutes=1))
+		running = self.add_listing(now + timedelta(days=1))
+		Bid.objects.create(amount=Decimal("12.00"), owner=self.bidder, listing=ended)
+
+		self.assertEqual(1, close_due_auctions(now=now))
+
+		ended.refresh_from_db()
+		running.refresh_from_db()
+		self.assertFalse(ended.isActive)
+		self.assertEqual(self.bidder, ended.winner)
+		self.assertTrue(running.isActive)
+
+	def test_due_auctions_are_closed_in_batches(self):
+		""" ensure that each tick closes at most one batch, earliest ending first"""
+		now = timezone.now()
+		listings = [self.add_listing(now - timedelta(minutes=minutes)) for minutes in (1, 2, 3)]
+
+		self.assertEqual(2, close_due_auctions(now=now, batch_size=2))
+		self.assertEqual([True, False, False],
+			[Listing.objects.get(pk=listing.pk).isActive for listing in listings])
+
+		out = StringIO()
+		call_command("close_auctions", stdout=out)
+		self.assertIn("closed 1 listing(s)", out.getvalue())
+		self.assertFalse(Listing.objects.filter(isActive=True).exists())
+
+	def test_bids_after_the_end_are_rejected(self):
+		""" ensure that an ended auction refuses bids before the scheduler closes it"""
+		listing = self.add_listing(timezone.now() - timedelta(seconds=1))
+
+		with self.assertRaises(BidRejected):
+			place_bid(listing.id, self.bidder, Decimal("20.00"))
+
+	def test_close_bid_records_winner(self):
+		""" ensure that a seller closing a listing makes the leader the winner"""
+		listing = self.add_listing(None)
+		Bid.objects.create(amount=Decimal("15.00"), owner=self.bidder, listing=listing)
+
+		self.assertTrue(close_listing(listing.id, self.seller))
+		self.assertEqual(self.bidder, Listing.objects.get(pk=listing.pk).winner)
+
+	def test_listing_form_rejects_end_in_the_past(self):
+		""" ensure that a new listing can't end before it starts"""
+		form = ListingForm({"title":"chair", "initialPrice":"10.00", "description":"a chair",
+			"category":self.category.name, "endsAt":"2001-01-01 12:00"})
+
+		self.assertFalse(form.is_valid())
+		self.assertIn("endsAt", form.errors)
+
+
+class ApiTests(QueryBudgetMixin, TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="client", password="clientclient")
+		cls.category = Category.objects.create(name="api")
+		cls.listing = Listing.objects.create(title="radio", seller=cls.user, initialPrice=Decimal("8.00"),
+					description="a valve radio", isActive=True, category=cls.category)
+
+	def test_listing_detail(self):
+		""" ensure that a listing is served with its seller and category by name"""
+		response = self.client.get(reverse("api_listing", args=[self.listing.id]))
+		data = response.json()
+
+		self.assertEqual("radio", data["title"])
+		self.assertEqual("client", data["seller"])
+		self.assertEqual("api", data["category"])
+		self.assertEqual("8.00", data["currentPrice"])
+
+	def test_listing_detail_conditional_get(self):
+		""" ensure that a matching If-None-Match is a 304 until the listing is bid on"""
+		url = reverse("api_listing", args=[self.listing.id])
+		etag = self.client.get(url)["ETag"]
+
+		with self.assertMaxQueries(1):
+			response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(304, response.status_code)
+		# as a compressing proxy would send it
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+		self.assertEqual(304, response.status_code)
+
+		Bid.objects.create(amount=Decimal("9.00"), owner=self.user, listing=self.listing)
+		response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(200, response.status_code)
+		self.assertNotEqual(etag, response["ETag"])
+
+	def test_bid_history_conditional_get_skips_bids(self):
+		""" ensure that an unchanged bid history is answered from the listing row alone"""
+		Bid.objects.create(amount=Decimal("9.00"), owner=self.user, listing=self.listing)
+		url = reverse("api_listing_bids", args=[self.listing.id])
+		response = self.client.get(url)
+		self.assertEqual([{"id":response.json()["bids"][0]["id"], "amount":"9.00", "owner":"client"}],
+			response.json()["bids"])
+
+		with self.assertMaxQueries(1):
+			response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+		self.assertEqual(304, response.status_code)
+
+	def test_listings_and_categories(self):
+		""" ensure that the collections list active listings and category names"""
+		response = self.client.get(reverse("api_listings"), data={"category":"api"})
+		self.assertEqual(["radio"], [listing["title"] for listing in response.json()["listings"]])
+		self.assertIsNone(response.json()["next_cursor"])
+
+		response = self.client.get(reverse("api_categories"))
+		self.assertEqual(["api"], response.json()["categories"])
+
+	def test_unknown_listing_and_bad_cursor(self):
+		""" ensure that errors come back as json with a matching status"""
+		self.assertEqual(404, self.client.get(reverse("api_listing", args=[999])).status_code)
+		self.assertEqual(400, self.client.get(reverse("api_listings"), data={"cursor":"x"}).status_code)
+
+class ImportTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="importer", password="importerimporter")
+
+	def test_csv_import_creates_listings_and_categories(self):
+		""" ensure that valid csv rows become active listings in their categories"""
+		rows = StringIO("title,description,initialPrice,category\n"
+			"lamp,a brass lamp,12.50,lighting\n"
+			"chair,an oak chair,30,\n")
+		report = import_listings(read_rows(rows, "csv"), self.user)
+
+		self.assertEqual((2, 0), (report.created, report.failed))
+		lamp = Listing.objects.get(title="lamp")
+		self.assertEqual(("lighting", Decimal("12.50"), Decimal("12.50")),
+			(lamp.category_id, lamp.initialPrice, lamp.currentPrice))
+		self.assertTrue(lamp.isActive)
+		self.assertEqual(self.user, lamp.seller)
+		self.assertEqual(Listing.DEFAULTCATEGORY, Listing.objects.get(title="chair").category_id)
+		self.assertTrue(Category.objects.filter(name="lighting").exists())
+		self.assertEqual([lamp.id], [listing.id for listing in search.search_listings("brass")])
+
+	def test_bad_rows_are_reported_by_line(self):
+		""" ensure that rows failing validation are skipped and reported with their line"""
+		rows = StringIO('{"title":"vase","description":"a glass vase","initialPrice":"5"}\n'
+			'not json\n'
+			'\n'
+			'{"title":"","description":"untitled","initialPrice":"-1"}\n')
+		report = import_listings(read_rows(rows, "jsonl"), self.user)
+
+		self.assertEqual((1, 2), (report.created, report.failed))
+		self.assertEqual([2, 4], [line for line, message in report.errors])
+		self.assertIn("title", report.errors[1][1])
+
+	def test_rows_are_inserted_in_chunks(self):
+		""" ensure that each chunk is inserted with one statement"""
+		rows = ((line, {"title":f"item {line}", "description":"bulk", "initialPrice":"1"}) for line in range(10))
+		with CaptureQueriesContext(connection) as queries:
+			report = import_listings(rows, self.user, chunk_size=4)
+
+		self.assertEqual(10, report.created)
+		inserts = [query for query in queries.captured_queries
+			if query["sql"].startswith('INSERT INTO "auctions_listing"')]
+		self.assertEqual(3, len(inserts))
+
+	def test_upload_endpoint(self):
+		""" ensure that a logged in user can upload a jsonl file of listings"""
+		upload = SimpleUploadedFile("listings.jsonl",
+			b'{"title":"kettle","description":"a copper kettle","initialPrice":"7"}\n{"title":"broken"}\n')
+		self.client.login(username="importer", password="importerimporter")
+		response = self.client.post(reverse("import_listings"), {"file":upload})
+
+		self.assertEqual(True, response.json()["success"])
+		self.assertEqual((1, 1), (response.json()["created"], response.json()["failed"]))
+		self.assertEqual(2, response.json()["errors"][0]["line"])
+		self.assertTrue(Listing.objects.filter(title="kettle", seller=self.user).exists())
+
+	def test_management_command(self):
+		""" ensure that import_listings loads a file for the named seller"""
+		path = os.path.join(self.tmpdir(), "listings.csv")
+		with open(path, "w") as f:
+			f.write("title,description,initialPrice\nclock,a mantel clock,15\n")
+		out = StringIO()
+		call_command("import_listings", path, seller="importer", stdout=out)
+
+		self.assertIn("imported 1 listing(s), 0 row(s) failed", out.getvalue())
+		self.assertTrue(Listing.objects.filter(title="clock").exists())
+
+	def test_unreadable_files_are_reported(self):
+		""" ensure that a file that stops being utf-8 is reported, keeping the rows read before"""
+		upload = SimpleUploadedFile("listings.csv",
+			"title,description,initialPrice\nlamp,a lamp,4\nsofa,a caf\u00e9 sofa,9\n".encode("latin-1"))
+		self.client.login(username="importer", password="importerimporter")
+		response = self.client.post(reverse("import_listings"), {"file":upload})
+
+		self.assertEqual(200, response.status_code)
+		self.assertEqual(False, response.json()["success"])
+		self.assertIn("can't be read", response.json()["file_error"])
+
+		path = os.path.join(self.tmpdir(), "listings.csv")
+		with open(path, "wb") as f:
+			f.write(b"title,description,initialPrice\n\xff\xfe,broken,1\n")
+		with self.assertRaisesMessage(CommandError, "can't be read: 'utf-8' codec"):
+			call_command("import_listings", path, seller="importer", stdout=StringIO(), stderr=StringIO())
+
+	def tmpdir(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		return directory.name
+
+class MetricsTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="watcher", password="watcherwatcher")
+		cls.staff = User.objects.create_user(username="ops", password="opsopsops", is_staff=True)
+		Listing.objects.create(title="globe", seller=cls.user, initialPrice=Decimal("4.00"),
+					description="a desk globe", isActive=True, category=Category.objects.create(name="maps"))
+
+	def setUp(self):
+		metrics.reset()
+
+	def test_server_timing_header(self):
+		""" ensure that responses report their sql and template time"""
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse("index"))
+
+		timing = response["Server-Timing"]
+		self.assertIn(f'desc="{len(queries)} queries"', timing)
+		self.assertRegex(timing, r"^db;dur=[\d.]+;desc=\"\d+ queries\", tpl;dur=[\d.]+, total;dur=[\d.]+$")
+
+	def test_histograms_by_view(self):
+		""" ensure that requests are counted in the histograms of their url name"""
+		self.client.get(reverse("index"))
+		self.client.get(reverse("index"))
+		self.client.get("/no-such-page")
+
+		self.client.login(username="ops", password="opsopsops")
+		report = self.client.get(reverse("metrics")).content.decode()
+
+		self.assertIn("# TYPE auctions_request_seconds histogram", report)
+		self.assertIn('auctions_request_seconds_count{view="index"} 2', report)
+		self.assertIn('auctions_request_seconds_bucket{view="index",le="+Inf"} 2', report)
+		self.assertIn('auctions_request_queries_count{view="unmatched"} 1', report)
+		template_sum = re.search(r'auctions_request_template_seconds_sum\{view="index"\} (\S+)', report)
+		self.assertGreater(float(template_sum.group(1)), 0)
+
+	def test_report_access(self):
+		""" ensure that only staff or a scraper with the token can read the metrics"""
+		self.client.login(username="watcher", password="watcherwatcher")
+		self.assertEqual(403, self.client.get(reverse("metrics")).status_code)
+		self.client.logout()
+
+		with self.settings(METRICS_TOKEN="s3cret"):
+			self.assertEqual(403, self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong").status_code)
+			response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret")
+		self.assertEqual(200, response.status_code)
+		self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+class DataGenerationTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.volumes = datagen.Volumes(users=8, categories=3, listings=30, bids=400, comments=50, watched=4)
+		datagen.generate(cls.volumes, random_seed=1, chunk_size=7)
+
+	def test_generated_volumes(self):
+		""" ensure that exactly the volumes asked for are written, with consistent bid stats"""
+		self.assertEqual(self.volumes, datagen.count_volumes())
+		self.assertFalse(any(listing.refreshBidStats() for listing in Listing.objects.all()))
+		self.assertFalse(Listing.objects.filter(isActive=False).exclude(winner=F("leadingBidder")).exists())
+		self.assertEqual(4 * 8, WatchlistEntry.objects.count())
+
+	def test_sequences_are_moved_past_the_loaded_ids(self):
+		""" ensure that the listing and bid sequences are reset, and rows created afterwards get new ids"""
+		with mock.patch.object(connection.ops, "sequence_reset_sql", return_value=[]) as reset:
+			datagen.reset_sequences(Listing, Bid)
+		self.assertEqual([Listing, Bid], list(reset.call_args[0][1]))
+
+		listing = Listing.objects.create(title="fresh", seller=User.objects.first(), initialPrice=Decimal("1.00"),
+					description="made after the load", isActive=True, category_id="category 0")
+		bid = Bid.objects.create(amount=Decimal("2.00"), owner=listing.seller, listing=listing)
+		self.assertEqual(bid, Listing.objects.get(pk=listing.pk).leadingBid)
+
+	def test_bids_follow_a_power_law(self):
+		""" ensure that a minority of listings draws most of the bids"""
+		counts = sorted(datagen.power_law_counts(100000, 1000, random.Random(3)), reverse=True)
+		self.assertEqual(100000, sum(counts))
+		self.assertGreater(sum(counts[:200]), 0.6 * 100000)
+
+	def test_same_seed_same_rows(self):
+		""" ensure that the rows only depend on the seed"""
+		first = list(Listing.objects.order_by("id").values_list("title", "bidCount", "currentPrice"))
+		with transaction.atomic():
+			Listing.objects.all().delete()
+			User.objects.filter(username__startswith=datagen.USERNAME_PREFIX).delete()
+			datagen.generate(self.volumes, random_seed=1, chunk_size=11)
+			second = list(Listing.objects.order_by("id").values_list("title", "bidCount", "currentPrice"))
+			transaction.set_rollback(True)
+		self.assertEqual(first, second)
+
+	def test_search_index_is_rebuilt(self):
+		""" ensure that generated listings can be searched although the triggers were off during the load"""
+		title = Listing.objects.order_by("id").values_list("title", flat=True).first()
+		results = search.search_listings(title, active_only=False, limit=1000)
+		self.assertIn(title, [listing.title for listing in results])
+
+	def test_refuses_to_generate_twice(self):
+		""" ensure that a second load into the same database is refused"""
+		with self.assertRaises(ValueError):
+			datagen.generate(self.volumes)
+
+
+class BenchmarkTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		datagen.generate(datagen.Volumes(users=5, categories=3, listings=20, bids=70, comments=10, watched=4))
+
+	def test_scenarios_run_without_errors(self):
+		""" ensure that every scenario times the requests asked for and none fail"""
+		fixture = benchmark.Fixture()
+		for name in benchmark.SCENARIOS:
+			summary = benchmark.run_scenario(name, fixture, requests=6, warmup=1).summary()
+			self.assertEqual((6, 0), (summary["requests"], summary["errors"]), name)
+			self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+
+	def test_bid_scenarios_count_rejections(self):
+		""" ensure that only redirected bids count as taken, a rejection rendering with a 200 doesn't"""
+		fixture = benchmark.Fixture()
+		low = benchmark.run_scenario("low_bid", fixture, requests=4, warmup=0).summary()
+		self.assertEqual((0, 4, 0), (low["accepted"], low["rejected"], low["errors"]))
+
+		made = benchmark.run_scenario("make_bid", fixture, requests=4, warmup=0).summary()
+		self.assertEqual(4, made["accepted"] + made["rejected"])
+		self.assertGreater(made["accepted"], 0)
+		self.assertNotIn("rejected", benchmark.run_scenario("index", fixture, requests=1, warmup=0).summary())
+
+	def test_percentile(self):
+		""" ensure that percentiles use the nearest rank"""
+		ordered = list(range(1, 101))
+		self.assertEqual((50, 99, 100), (benchmark.percentile(ordered, 0.5), benchmark.percentile(ordered, 0.99),
+			benchmark.percentile(ordered, 1)))
+		self.assertIsNone(benchmark.percentile([], 0.5))
+
+class DatabaseProfileTests(TransactionTestCase):
+
+	def sqlite_connection(self):
+		directory = tempfile.TemporaryDirectory()
+		self.addCleanup(directory.cleanup)
+		settings_dict = dict(connection.settings_dict, NAME=os.path.join(directory.name, "db.sqlite3"))
+		wrapper = connections["default"].__class__(settings_dict, alias="profile")
+		self.addCleanup(wrapper.close)
+		return wrapper
+
+	@skipUnless(connection.vendor == "sqlite", "sqlite only")
+	def test_sqlite_pragmas(self):
+		""" ensure that new sqlite connections use the pragmas, WAL with normal syncing as gunicorn sets it"""
+		with self.sqlite_connection().cursor() as cursor:
+			cursor.execute("PRAGMA journal_mode")
+			self.assertEqual("delete", cursor.fetchone()[0])
+			cursor.execute("PRAGMA synchronous")
+			self.assertEqual(2, cursor.fetchone()[0])
+			cursor.execute("PRAGMA mmap_size")
+			self.assertEqual(settings.SQLITE_PRAGMAS["mmap_size"], cursor.fetchone()[0])
+
+		with override_settings(SQLITE_PRAGMAS={"journal_mode":"wal", "synchronous":"normal"}):
+			with self.sqlite_connection().cursor() as cursor:
+				cursor.execute("PRAGMA journal_mode")
+				self.assertEqual("wal", cursor.fetchone()[0])
+				cursor.execute("PRAGMA synchronous")
+				self.assertEqual(1, cursor.fetchone()[0])
+
+	@skipUnless(connection.vendor == "sqlite", "sqlite only")
+	def test_sqlite_pragmas_are_checked(self):
+		""" ensure that a pragma value can't smuggle in more sql"""
+		with override_settings(SQLITE_PRAGMAS={"journal_mode": "wal; DROP TABLE auctions_bid"}):
+			with self.assertRaises(ValueError):
+				self.sqlite_connection().cursor()
+
+	@skipUnless(connection.vendor == "postgresql", "run the suite with DATABASE_ENGINE=postgresql")
+	def test_postgres_connections_persist(self):
+		""" ensure that a postgres connection outlives a request"""
+		self.assertGreater(connection.settings_dict["CONN_MAX_AGE"], 0)
+		self.client.get(reverse("index"))
+		first = connection.connection
+		self.client.get(reverse("index"))
+		self.assertIs(first, connection.connection)
+
+class SessionTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="reader", password="readerreader")
+		cls.listing = Listing.objects.create(title="atlas", seller=cls.user, initialPrice=Decimal("6.00"),
+					description="a road atlas", isActive=True, category=Category.objects.create(name="books"))
+
+	def read_pages(self):
+		return [self.client.get(reverse("index")), self.client.get(reverse("categories")),
+			self.client.get(reverse("single_listing", args=["atlas"]), data={"id":self.listing.id})]
+
+	def session_queries(self, queries):
+		return [query["sql"] for query in queries.captured_queries if "django_session" in query["sql"]]
+
+	def test_anonymous_reads_have_no_session(self):
+		""" ensure that browsing without logging in never creates or reads a session"""
+		with CaptureQueriesContext(connection) as queries:
+			responses = self.read_pages()
+
+		self.assertEqual([], self.session_queries(queries))
+		self.assertFalse(any(settings.SESSION_COOKIE_NAME in response.cookies for response in responses))
+
+	@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db")
+	def test_logged_in_reads_skip_the_session_table(self):
+		""" ensure that a logged in user's reads neither write the session nor look it up in the database"""
+		self.client.login(username="reader", password="readerreader")
+		with CaptureQueriesContext(connection) as queries:
+			responses = self.read_pages()
+			self.client.get(reverse("show_watchlist"))
+
+		self.assertEqual([], self.session_queries(queries))
+		self.assertFalse(any(settings.SESSION_COOKIE_NAME in response.cookies for response in responses))
+
+	def test_watching_writes_no_session(self):
+		""" ensure that watching a listing is stored in the database, not the session"""
+		self.client.login(username="reader", password="readerreader")
+		session = dict(self.client.session)
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get(reverse("edit_watchlist"), data={"listing_id":self.listing.id, "action":"add"})
+
+		self.assertTrue(WatchlistEntry.objects.filter(user=self.user, listing=self.listing).exists())
+		self.assertEqual([], [sql for sql in self.session_queries(queries) if not sql.startswith("SELECT")])
+		self.assertEqual(session, dict(self.client.session))
+
+	def test_cached_sessions_need_a_shared_cache(self):
+		""" ensure that sessions cached in a cache of each process's own are refused"""
+		self.assertEqual([], checks.check_session_cache(None))
+		with self.settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db"):
+			self.assertEqual(["auctions.E001"], [error.id for error in checks.check_session_cache(None)])
+		with self.settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db", CACHES={"default":{
+				"BACKEND":"django.core.cache.backends.memcached.PyMemcacheCache"}}):
+			self.assertEqual([], checks.check_session_cache(None))
+
+	@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+	def test_signed_cookie_sessions(self):
+		""" ensure that the site works with sessions kept in a signed cookie"""
+		self.client.login(username="reader", password="readerreader")
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse("show_watchlist"))
+
+		self.assertEqual(200, response.status_code)
+		self.assertEqual([], self.session_queries(queries))
+
+class AsyncViewTests(TransactionTestCase):
+	# under ASGI the views query from worker threads with their own connections
+
+	def setUp(self):
+		self.user = User.objects.create_user(username="bidder", password="bidderbidder")
+		self.listing = Listing.objects.create(title="kettle", seller=self.user, initialPrice=Decimal("9.00"),
+					description="a copper kettle", isActive=True, category=Category.objects.create(name="kitchen"))
+
+	def asgi_get(self, path, query="", cookies=""):
+		from commerce.asgi import application
+
+		async def get():
+			app = ApplicationCommunicator(application, {"type":"http", "method":"GET", "path":path,
+				"query_string":query.encode(), "headers":[(b"host", b"localhost"), (b"cookie", cookies.encode())]})
+			await app.send_input({"type":"http.request"})
+			start = await app.receive_output(5)
+			body = await app.receive_output(5)
+			chunks = [body["body"]]
+			while body.get("more_body"):
+				body = await app.receive_output(5)
+				chunks.append(body.get("body", b""))
+			return start["status"], b"".join(chunks).decode()
+
+		return async_to_sync(get)()
+
+	def test_middleware_is_async_capable(self):
+		""" ensure that no middleware makes django hand an ASGI request over to a thread"""
+		from django.utils.module_loading import import_string
+		sync_only = [path for path in settings.MIDDLEWARE if not getattr(import_string(path), "async_capable", False)]
+		self.assertEqual([], sync_only)
+
+	def test_read_views_are_async(self):
+		""" ensure that the read only pages and the api are coroutine functions"""
+		from . import api, views
+		for view in (views.index, views.categories, views.category_listings, views.single_listing,
+				views.in_watchlist, api.listings, api.listing, api.listing_bids, api.categories):
+			self.assertTrue(asyncio.iscoroutinefunction(view), view.__name__)
+
+	def test_pages_under_asgi(self):
+		""" ensure that the async views render for a logged in user under ASGI"""
+		self.client.login(username="bidder", password="bidderbidder")
+		cookies = "; ".join(f"{name}={morsel.value}" for name, morsel in self.client.cookies.items())
+		WatchlistEntry.objects.create(user=self.user, listing=self.listing)
+
+		status, body = self.asgi_get(reverse("index"), cookies=cookies)
+		self.assertEqual(200, status)
+		self.assertIn("kettle", body)
+		self.assertIn("bidder", body)
+
+		status, body = self.asgi_get(reverse("single_listing", args=["kettle"]), f"id={self.listing.id}", cookies)
+		self.assertEqual(200, status)
+		self.assertIn("copper kettle", body)
+
+		status, body = self.asgi_get(reverse("category_listings", args=["kitchen"]), cookies=cookies)
+		self.assertEqual(200, status)
+		self.assertIn("kettle", body)
+
+		status, body = self.asgi_get(reverse("in_watchlist"), f"listing_id={self.listing.id}", cookies)
+		self.assertEqual({"in_watchlist":True, "success":True}, json.loads(body))
+
+	def test_api_under_asgi(self):
+		""" ensure that the async api answers under ASGI"""
+		status, body = self.asgi_get(reverse("api_listing", args=[self.listing.id]))
+		self.assertEqual(200, status)
+		self.assertEqual("kettle", json.loads(body)["title"])
+
+		status, body = self.asgi_get(reverse("api_categories"))
+		self.assertEqual(["kitchen"], json.loads(body)["categories"])
+
+	def test_bid_export_under_asgi(self):
+		""" ensure that a streamed export reads the database off the event loop a chunk at a time"""
+		for amount in ("10.00", "11.00", "12.00"):
+			Bid.objects.create(amount=Decimal(amount), owner=self.user, listing=self.listing)
+
+		# the handler awaits each chunk rather than iterating the response on the loop
+		with mock.patch.object(bid_history, "EXPORT_CHUNK_SIZE", 2), \
+				mock.patch.object(bid_history, "walk", side_effect=AssertionError("read on the event loop")):
+			status, body = self.asgi_get(reverse("api_listing_bids", args=[self.listing.id]), "format=csv")
+
+		self.assertEqual(200, status)
+		self.assertEqual(["id,amount,owner", "12.00", "11.00", "10.00"],
+			[line.split(",")[1] if line[0].isdigit() else line for line in body.splitlines()])
+
+	def test_api_is_read_only(self):
+		""" ensure that the async api still turns away anything but GET and HEAD"""
+		response = self.client.post(reverse("api_listings"))
+		self.assertEqual(405, response.status_code)
+		self.assertEqual("GET, HEAD", response["Allow"])
+
+
+class CategoryCountTests(QueryBudgetMixin, TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="counter", password="countcountcount")
+		cls.lamps = Category.objects.create(name="lamps")
+		cls.maps = Category.objects.create(name="maps")
+
+	def setUp(self):
+		category_counts.get_cache().clear()
+
+	def make_listing(self, category, active=True):
+		return Listing.objects.create(title="item", seller=self.user, initialPrice=Decimal("2.00"),
+					description="an item", isActive=active, category=category)
+
+	def counts(self):
+		return dict(Category.objects.filter(name__in=["lamps", "maps"]).values_list("name", "activeCount"))
+
+	def test_counts_follow_listings(self):
+		""" ensure that creating, closing and deleting listings keep the active counts right"""
+		first, second = self.make_listing(self.lamps), self.make_listing(self.lamps)
+		self.make_listing(self.maps, active=False)
+		self.assertEqual({"lamps":2, "maps":0}, self.counts())
+
+		close_listing(first.id, self.user)
+		close_listing(first.id, self.user)
+		self.assertEqual({"lamps":1, "maps":0}, self.counts())
+
+		second.delete()
+		self.assertEqual({"lamps":0, "maps":0}, self.counts())
+
+	def test_closing_due_auctions_counts_per_category(self):
+		""" ensure that closing a batch of listings takes each off its own category"""
+		for category in (self.lamps, self.lamps, self.maps):
+			listing = self.make_listing(category)
+			listing.endsAt = timezone.now() - timedelta(minutes=1)
+			listing.save()
+
+		self.assertEqual(3, close_due_auctions())
+		self.assertEqual({"lamps":0, "maps":0}, self.counts())
+
+	def test_import_counts_listings(self):
+		""" ensure that imported listings are counted, in categories the import creates too"""
+		rows = [(1, {"title":"a", "description":"a", "initialPrice":"1", "category":"lamps"}),
+			(2, {"title":"b", "description":"b", "initialPrice":"1", "category":"globes"})]
+		import_listings(rows, self.user)
+
+		self.assertEqual(1, Category.objects.get(name="lamps").activeCount)
+		self.assertEqual(1, Category.objects.get(name="globes").activeCount)
+
+	def test_categories_page_reads_one_cached_query(self):
+		""" ensure that the categories page shows the counts from one query, then from the cache"""
+		self.make_listing(self.maps)
+		with self.assertMaxQueries(1):
+			response = self.client.get(reverse("categories"))
+		self.assertIn(("maps", 1), response.context["categories"])
+
+		with self.assertMaxQueries(0):
+			self.client.get(reverse("categories"))
+
+		# a new listing is shown straight away
+		self.make_listing(self.maps)
+		response = self.client.get(reverse("categories"))
+		self.assertIn(("maps", 2), response.context["categories"])
+
+	def test_categories_sorted_by_popularity(self):
+		""" ensure that ?sort=popular lists the categories with the most active listings first"""
+		self.make_listing(self.maps)
+		response = self.client.get(reverse("categories"), {"sort":"popular"})
+		counts = [count for _, count in response.context["categories"]]
+
+		self.assertEqual(("maps", 1), response.context["categories"][0])
+		self.assertEqual(sorted(counts, reverse=True), counts)
+
+	def test_reconcile_repairs_drift(self):
+		""" ensure that the reconcile command recounts categories whose counts have drifted"""
+		self.make_listing(self.lamps)
+		Category.objects.filter(name="lamps").update(activeCount=7)
+		Category.objects.filter(name="maps").update(activeCount=3)
+
+		out = StringIO()
+		call_command("reconcile_category_counts", "lamps", "maps", stdout=out)
+
+		self.assertEqual({"lamps":1, "maps":0}, self.counts())
+		self.assertIn("checked 2 categories, repaired 2", out.getvalue())
+
+
+class BidHistoryTests(QueryBudgetMixin, TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.seller = User.objects.create_user(username="auditor", password="auditaudit")
+		cls.bidder = User.objects.create_user(username="bidder", password="bidbidbid")
+		category = Category.objects.create(name="audited")
+		cls.listing = Listing.objects.create(title="clock", seller=cls.seller, initialPrice=Decimal("1.00"),
+					description="a clock", isActive=True, category=category)
+		cls.other = Listing.objects.create(title="vase", seller=cls.seller, initialPrice=Decimal("1.00"),
+					description="a vase", isActive=True, category=category)
+		for amount in range(1, 6):
+			Bid.objects.create(amount=Decimal(amount), owner=cls.bidder, listing=cls.listing)
+		Bid.objects.create(amount=Decimal("3.00"), owner=cls.bidder, listing=cls.other)
+
+	def walk(self, url):
+		""" follows next_cursor from the first page to the last, returning every bid"""
+		bids, params = [], {}
+		while True:
+			response = self.client.get(url, params)
+			self.assertEqual(200, response.status_code)
+			bids += response.json()["bids"]
+			if response.json()["next_cursor"] is None:
+				return bids
+			params = {"cursor":response.json()["next_cursor"]}
+
+	@override_settings(LISTINGS_PAGE_SIZE=2)
+	def test_listing_history_pages_highest_first(self):
+		""" ensure that a listing's bids are paged highest first by an amount and id cursor"""
+		bids = self.walk(reverse("api_listing_bids", args=[self.listing.id]))
+
+		self.assertEqual(["5.00", "4.00", "3.00", "2.00", "1.00"], [bid["amount"] for bid in bids])
+		self.assertEqual({"bidder"}, {bid["owner"] for bid in bids})
+
+	@override_settings(LISTINGS_PAGE_SIZE=2)
+	def test_user_history_pages_newest_first(self):
+		""" ensure that a user's bids across listings are paged newest first"""
+		bids = self.walk(reverse("api_user_bids", args=["bidder"]))
+
+		self.assertEqual(6, len(bids))
+		self.assertEqual("vase", bids[0]["listing_title"])
+		self.assertEqual(sorted((bid["id"] for bid in bids), reverse=True), [bid["id"] for bid in bids])
+
+	def test_bad_requests(self):
+		""" ensure that bad cursors, formats and users are refused"""
+		url = reverse("api_listing_bids", args=[self.listing.id])
+		self.assertEqual(400, self.client.get(url, {"cursor":"5.00"}).status_code)
+		self.assertEqual(400, self.client.get(url, {"cursor":"NaN_3"}).status_code)
+		self.assertEqual(400, self.client.get(url, {"format":"xml"}).status_code)
+		self.assertEqual(404, self.client.get(reverse("api_user_bids", args=["nobody"])).status_code)
+
+	def test_csv_export_streams_in_chunks(self):
+		""" ensure that an export is streamed and read one chunk of rows per query"""
+		url = reverse("api_listing_bids", args=[self.listing.id])
+		with mock.patch.object(bid_history, "EXPORT_CHUNK_SIZE", 2), CaptureQueriesContext(connection) as queries:
+			response = self.client.get(url, {"format":"csv"})
+			before = len(queries)
+			lines = b"".join(response.streaming_content).decode().splitlines()
+
+		self.assertTrue(response.streaming)
+		self.assertEqual("text/csv", response["Content-Type"])
+		self.assertEqual(["id,amount,owner"] + [f"{bid.id},{bid.amount},bidder"
+			for bid in self.listing.bids.order_by("-amount")], lines)
+		# five rows in chunks of two
+		self.assertEqual(3, len(queries) - before)
+
+	def test_jsonl_export(self):
+		""" ensure that a user's bids export as one json object per line"""
+		response = self.client.get(reverse("api_user_bids", args=["bidder"]), {"format":"jsonl"})
+		rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+
+		self.assertEqual(6, len(rows))
+		self.assertEqual({"id", "amount", "listing", "listing_title"}, set(rows[0]))
+		self.assertIn('filename="bidder-bids.jsonl"', response["Content-Disposition"])
+
+	def test_empty_csv_export_has_a_header(self):
+		""" ensure that exporting a listing without bids gives just the header"""
+		listing = Listing.objects.create(title="bare", seller=self.seller, initialPrice=Decimal("1.00"),
+					description="unbid", isActive=True, category_id="audited")
+		response = self.client.get(reverse("api_listing_bids", args=[listing.id]), {"format":"csv"})
+		self.assertEqual("id,amount,owner\r\n", b"".join(response.streaming_content).decode())
+
+
+class AdminTests(QueryBudgetMixin, TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.admin_user = User.objects.create_superuser(username="root", password="rootrootroot")
+		cls.category = Category.objects.create(name="admin")
+		cls.listing = Listing.objects.create(title="desk", seller=cls.admin_user, initialPrice=Decimal("1.00"),
+					description="a desk", isActive=True, category=cls.category)
+
+	def setUp(self):
+		self.client.force_login(self.admin_user)
+
+	def add_rows(self, count):
+		for i in range(count):
+			Bid.objects.create(amount=Decimal(i + 2), owner=self.admin_user, listing=self.listing)
+			Comment.objects.create(comment=f"comment {i}", commenter=self.admin_user, listing=self.listing)
+
+	def changelist_queries(self, model, params=None):
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse(f"admin:auctions_{model}_changelist"), params or {})
+		self.assertEqual(200, response.status_code)
+		return len(queries)
+
+	def test_changelists_dont_query_per_row(self):
+		""" ensure that the bid, comment and listing changelists run as many queries for many rows as for one"""
+		self.add_rows(1)
+		few = {model: self.changelist_queries(model) for model in ("bid", "comment", "listing", "user")}
+		self.add_rows(20)
+		many = {model: self.changelist_queries(model) for model in ("bid", "comment", "listing", "user")}
+
+		self.assertEqual(few, many)
+
+	def test_search_by_text_skips_id_fields(self):
+		""" ensure that searching a changelist for a name rather than an id isn't an error"""
+		self.add_rows(1)
+		self.changelist_queries("bid", {"q":"root"})
+		self.changelist_queries("bid", {"q":str(self.listing.id)})
+		self.changelist_queries("listing", {"q":"root"})
+
+	def test_change_forms_use_raw_ids(self):
+		""" ensure that foreign keys on change forms aren't drop downs of every row"""
+		self.add_rows(1)
+		bid = Bid.objects.first()
+		response = self.client.get(reverse("admin:auctions_bid_change", args=[bid.id]))
+		self.assertContains(response, 'class="vForeignKeyRawIdAdminField"', count=2)
+
+		response = self.client.get(reverse("admin:auctions_listing_change", args=[self.listing.id]))
+		self.assertContains(response, "admin-autocomplete")
+
+	def test_paginator_estimates_huge_tables(self):
+		""" ensure that an unfiltered table over the threshold is estimated and a filtered one counted up to the limit"""
+		self.add_rows(5)
+		bids = Bid.objects.order_by("-id")
+		with mock.patch.object(admin, "ESTIMATE_THRESHOLD", 2), mock.patch.object(admin, "COUNT_LIMIT", 3):
+			self.assertEqual(bids.aggregate(m=Max("id"))["m"], admin.EstimatedCountPaginator(bids, 2).count)
+			self.assertEqual(3, admin.EstimatedCountPaginator(bids.filter(listing=self.listing), 2).count)
+
+		self.assertEqual(5, admin.EstimatedCountPaginator(bids, 2).count)
+
+
+class CommentPageTests(TestCase):
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		cls.user = User.objects.create_user(username="chatter", password="chatchatchat")
+		category = Category.objects.create(name="discussed")
+		cls.listing = Listing.objects.create(title="lamp", seller=cls.user, initialPrice=Decimal("1.00"),
+					description="a lamp", isActive=True, category=category)
+		cls.bare = Listing.objects.create(title="stool", seller=cls.user, initialPrice=Decimal("1.00"),
+					description="a stool", isActive=True, category=category)
+		for i in range(5):
+			Comment.objects.create(comment=f"comment {i}", commenter=cls.user, listing=cls.listing)
+
+	@override_settings(COMMENTS_PAGE_SIZE=2)
+	def test_page_shows_newest_comments(self):
+		""" ensure that the detail page renders one page of comments and a cursor for the rest"""
+		response = self.client.get(reverse("single_listing", args=[self.listing.title]), {"id":self.listing.id})
+
+		self.assertEqual(["comment 4", "comment 3"], [comment.comment for comment in response.context["comments"]])
+		self.assertIsNotNone(response.context["comments_cursor"])
+		self.assertContains(response, 'id="more-comments"')
+
+	def test_page_without_more_comments_has_no_button(self):
+		""" ensure that the load more button only shows when there are older comments"""
+		response = self.client.get(reverse("single_listing", args=[self.listing.title]), {"id":self.listing.id})
+
+		self.assertEqual(5, len(response.context["comments"]))
+		self.assertNotContains(response, 'id="more-comments"')
+
+	@override_settings(COMMENTS_PAGE_SIZE=2)
+	def test_api_pages_newest_first(self):
+		""" ensure that following next_cursor walks every comment once, newest first"""
+		url = reverse("api_listing_comments", args=[self.listing.id])
+		comments, params = [], {}
+		while True:
+			response = self.client.get(url, params)
+			self.assertEqual(200, response.status_code)
+			comments += response.json()["comments"]
+			if response.json()["next_cursor"] is None:
+				break
+			params = {"cursor":response.json()["next_cursor"]}
+
+		self.assertEqual([f"comment {i}" for i in range(4, -1, -1)], [comment["comment"] for comment in comments])
+		self.assertEqual({"chatter"}, {comment["commenter"] for comment in comments})
+
+	def test_bad_requests(self):
+		""" ensure that bad cursors and missing listings are refused, a listing without comments isn't"""
+		url = reverse("api_listing_comments", args=[self.listing.id])
+		self.assertEqual(400, self.client.get(url, {"cursor":"abc"}).status_code)
+		self.assertEqual(404, self.client.get(reverse("api_listing_comments", args=[0])).status_code)
+
+		response = self.client.get(reverse("api_listing_comments", args=[self.bare.id]))
+		self.assertEqual({"comments":[], "next_cursor":None}, response.json())
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 
 urlpatterns = [
     path("", views.index, name="index"),
@@ -8,13 +8,26 @@ urlpatterns = [
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
     path("create_listing", views.create_listing, name="create_listing"),
+    path("import_listings", views.import_listings_upload, name="import_listings"),
     path("categories", views.categories, name="categories"),
     path("categories/<str:category>", views.category_listings, name="category_listings"),
+    path("search", views.search, name="search"),
     path("watchlist", views.watchlist, name="show_watchlist"),
     path("listings/<str:listing>", views.single_listing, name="single_listing"),
+    path("listings/<int:listing_id>/events", views.listing_events, name="listing_events"),
     path("edit_watchlist", views.add_or_delete_from_watchlist, name="edit_watchlist"),
     path("in_watchlist", views.in_watchlist, name="in_watchlist"),
+    path("watchlist_status", views.watchlist_status, name="watchlist_status"),
     path("make_bid/<int:listing_id>", views.make_bid, name="make_bid"),
     path("close_bid/<int:listing_id>", views.close_bid, name="close_bid"),
-    path("add_comment/<int:listing_id>", views.add_comment, name="add_comment")
+    path("add_comment/<int:listing_id>", views.add_comment, name="add_comment"),
+    path("card_cache_stats", views.card_cache_stats, name="card_cache_stats"),
+    path("metrics", views.metrics_report, name="metrics"),
+
+    path("api/v1/listings", api.listings, name="api_listings"),
+    path("api/v1/listings/<int:listing_id>", api.listing, name="api_listing"),
+    path("api/v1/listings/<int:listing_id>/bids", api.listing_bids, name="api_listing_bids"),
+    path("api/v1/listings/<int:listing_id>/comments", api.listing_comments, name="api_listing_comments"),
+    path("api/v1/users/<str:username>/bids", api.user_bids, name="api_user_bids"),
+    path("api/v1/categories", api.categories, name="api_categories")
 ]
@@ -1,3 +1,5 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.core.serializers import serialize
@@ -8,20 +10,66 @@ from django.shortcuts import render, redirect
 from django.urls import reverse
 
 from decimal import *
+import hmac
+import io
+import os
 
 
+from . import category_counts, fragments, metrics
+from .bidding import BidRejected, close_listing
 from .models import *
 from .forms import *
+from .importer import FORMATS, import_listings, read_rows
+from .ingest import take_bid
+from .pagination import InvalidCursor, get_cursor, keyset_page
+from .search import search_listings
+
+# most listing ids a single watchlist status request may ask about
+MAX_STATUS_IDS = 100
+
+""" The read only pages are async views. Under ASGI they give up their thread
+while the database work, the only blocking part, runs through in_thread. What
+they render has been loaded by then, so templates never query. Under WSGI
+django runs them to completion like any other view."""
+
+async def in_thread(request, load, *args):
+    """ runs the database work of an async view in a thread and returns its result.
+    request.user is looked up there too, so templates can use it without querying"""
+    def run():
+        request.user.is_authenticated
+        return load(*args)
+    return await sync_to_async(run)()
+
+def feed_context(request, listings, watch_badges=True):
+    """ loads one keyset page of listings with their cards, the next page's cursor
+    and the ids on the page the user is watching, raises InvalidCursor"""
+    page, next_cursor = keyset_page(listings, get_cursor(request))
+    fragments.render_cards(page)
+
+    watched_ids = set()
+    if watch_badges:
+        watched_ids = WatchlistEntry.watchedAmong(request.user, [listing.id for listing in page])
+    return {"listings":page, "next_cursor":next_cursor, "watched_ids":watched_ids}
+
+def cursor_error(request, cursor):
+    return render(request, "auctions/errors.html", {"error_message":f"the cursor {cursor} is not valid"})
+
+def render_feed(request, template, listings, context=None, watch_badges=True):
+    """ renders one keyset page of listings, the next page's cursor goes in the context
+    along with the ids on the page the user is watching"""
+    try:
+        feed = feed_context(request, listings, watch_badges)
+    except InvalidCursor as cursor:
+        return cursor_error(request, cursor)
+    return render(request, template, dict(context or {}, **feed))
 
-def index(request):
+async def index(request):
     """ render the all the active listings """
-
-    # todo implement
-    # create a watchlist for a user if Logged in and the watchlist doesn't yet exist
-    if request.user.is_authenticated and "watchlist" not in request.session:
-        request.session["watchlist"] = []
-    
-    return render(request, "auctions/index.html", {"listings": Listing.objects.filter(isActive=True)})
+    try:
+        feed = await in_thread(request, feed_context, request, Listing.objects.filter(isActive=True).cards())
+    except InvalidCursor as cursor:
+        return cursor_error(request, cursor)
+    return render(request, "auctions/index.html", feed)
 
 @login_required(login_url="/login")
 def create_listing(request):
@@ -30,12 +78,11 @@ def create_listing(request):
 
         # validate and save from the formdata to the database
         form = ListingForm(request.POST)
-        DEFAULTIMAGEURL = "https://res.cloudinary.com/opuye/image/upload/h_300,c_scale/v1598563707/no-image.png"
 
         try:
             listing = form.save(commit=False)
             if not listing.imageUrl:
-                listing.imageUrl = DEFAULTIMAGEURL
+                listing.imageUrl = Listing.DEFAULTIMAGEURL
 
             listing.seller = request.user
             listing.isActive = True
@@ -49,42 +96,93 @@ def create_listing(request):
         return render(request, "auctions/create_listing.html",{ 
                         "form":ListingForm(initial={"imageUrl":""})})
 
-def categories(request):
-    # get all the category names from the database and render
-    categories = Category.objects.all().values_list("name", flat=True).order_by("name")
-    return render(request, "auctions/categories.html", {"categories":categories})
-
-def category_listings(request, category):
+@login_required(login_url="/login")
+def import_listings_upload(request):
+    """ imports the listings of an uploaded csv or json lines file for the user"""
+    if request.method != "POST" or "file" not in request.FILES:
+        return JsonResponse({"success":False, "error":"post a csv or jsonl file as file"})
+
+    upload = request.FILES["file"]
+    format = request.POST.get("format") or os.path.splitext(upload.name)[1].lstrip(".").lower()
+    if format not in FORMATS:
+        return JsonResponse({"success":False, "error":f"the format has to be one of {', '.join(FORMATS)}"})
+
+    # read the upload as a stream of lines rather than loading it whole
+    stream = io.TextIOWrapper(upload.file, encoding="utf-8", newline="")
+    report = import_listings(read_rows(stream, format), request.user)
+
+    # rows read before a file error are imported all the same
+    return JsonResponse({"success":report.file_error is None, "created":report.created, "failed":report.failed,
+        "errors":[{"line":line, "error":message} for line, message in report.errors],
+        "file_error":report.file_error})
+
+async def categories(request):
+    """ render the categories with how many active listings each has, by name or
+    with ?sort=popular most active first"""
+    popular = request.GET.get("sort") == "popular"
+    categories = await in_thread(request, category_counts.category_counts, popular)
+    return render(request, "auctions/categories.html", {"categories":categories, "popular":popular})
+
+async def category_listings(request, category):
     # get a particular category from the database and get its active listings
+    def load():
+        listings = Listing.objects.filter(category__name=category, isActive=True).cards()
+        return Category.objects.filter(name=category).first(), feed_context(request, listings)
+
     try:
-        category = Category.objects.get(name=category)
-    except  Category.DoesNotExist:
+        category_row, feed = await in_thread(request, load)
+    except InvalidCursor as cursor:
+        return cursor_error(request, cursor)
+    if category_row is None:
         return render(request, "auctions/errors.html", {"error_message":f"the url argument {category} is not valid"})
 
-    category_listings = category.listings.filter(isActive=True).values()
-    return render(request, "auctions/category_listings.html", {"listings":category_listings})
+    return render(request, "auctions/category_listings.html", dict(feed, category=category_row))
+
+def search(request):
+    """ full text search over listing titles and descriptions, optionally within
+    a category and including closed listings"""
+    query = request.GET.get("q", "").strip()
+    category = request.GET.get("category") or None
+    include_closed = request.GET.get("closed") == "1"
+
+    listings = search_listings(query, category, active_only=not include_closed) if query else []
+    return render(request, "auctions/search.html", {
+        "query":query, "category":category, "include_closed":include_closed,
+        "listings":listings,
+        "watched_ids":WatchlistEntry.watchedAmong(request.user, [listing.id for listing in listings]),
+        "categories":Category.objects.values_list("name", flat=True).order_by("name")
+    })
 
-def single_listing(request, listing):
+async def single_listing(request, listing):
     # on get display the listing if parameters are valid
-    try:
-        listing = Listing.objects.get(id=request.GET["id"], title=listing)
-    except Listing.DoesNotExist:
+    def load(title):
+        listing = Listing.objects.detail().filter(id=request.GET["id"], title=title).first()
+        if listing is None:
+            return None, False, ([], None)
+        # embed the watchlist state so the page doesn't have to ask for it
+        is_in_watchlist = listing.id in WatchlistEntry.watchedAmong(request.user, [listing.id])
+        # only the newest comments, the page loads the rest as they're asked for
+        return listing, is_in_watchlist, Comment.page(listing.id)
+
+    listing, is_in_watchlist, (comments, comments_cursor) = await in_thread(request, load, listing)
+    if listing is None:
          return render(request, "auctions/errors.html", {
             "error_message":"listing does not exist, url arguements might be wrong"
         })
     
     # if the user is logged in and the listing is closed, check if the user is the winner of the bid
     if request.user.is_authenticated and listing.isClosed():
-        user_is_winner = listing.highestBidder() == request.user
+        user_is_winner = listing.leadingBidder_id == request.user.id
     else:
         user_is_winner = False
 
-
     # create a comment model form to be displayed on the page 
     CommentForm = modelform_factory(Comment, exclude=("commenter","listing"))
     
     return render(request, "auctions/single_listing.html",{
         "listing":listing, "user_is_winner":user_is_winner,
+        "is_in_watchlist":is_in_watchlist,
+        "comments":comments, "comments_cursor":comments_cursor,
         "commentform":CommentForm,
         "category": listing.category.name 
     })
@@ -104,37 +202,21 @@ def make_bid(request, listing_id):
                 "error_message":
                 "Invalid parameter: the arguement you passed as a bid is not in the correct format"
                 })
-       # might add test case
+
+        # validate and record the bid in one step so concurrent bids can't both win
         try:
-            listing = Listing.objects.get(pk=listing_id)
-        except  Listing.DoesNotExist:
-            return render(request, "auctions/errors.html", {"error_message":f"error: listing_id not valid"})
-        
-        # if the bid is valid create a new bid object, save to db and update the listing price
-        if listing.isActive and listing.isValidBid(bid):
-            Bid.objects.create(amount=bid, listing=listing, owner=request.user)
-            return redirect(reverse("single_listing", 
-                args=[listing.title]) +f"?id={listing.id}")
-            
-        # render error if the bid doesn't pass requirements
-        return render(request, "auctions/errors.html", {
-            "error_message":" your bid is not valid, it's too small"
-        }) 
+            bid = take_bid(listing_id, request.user, bid)
+        except BidRejected as rejection:
+            return render(request, "auctions/errors.html", {"error_message":str(rejection)})
+
+        listing = bid.listing
+        return redirect(reverse("single_listing", 
+            args=[listing.title]) +f"?id={listing.id}")
 
 @login_required(login_url="/login")
 def close_bid(request, listing_id):
     """ turns a listing inactive, so no more bids can be made""" 
-    try:
-       listing = Listing.objects.get(pk=listing_id) 
-    except  Listing.DoesNotExist:
-        return JsonResponse({"success":False})
-
-    if request.user == listing.seller:
-        listing.isActive = False
-        listing.save()
-        return JsonResponse({"success":True})
-
-    return JsonResponse({"success":False})
+    return JsonResponse({"success":close_listing(listing_id, request.user)})
 
 @login_required
 def add_comment(request, listing_id):
@@ -165,50 +247,85 @@ def add_comment(request, listing_id):
 @login_required(login_url="/login")
 def watchlist(request):
     # returns the listings in a watchlist 
-    listofPks = request.session["watchlist"]
-    return render(request, "auctions/watchlist.html", 
-        {"listings": Listing.objects.in_bulk(listofPks).values()})
+    return render_feed(request, "auctions/watchlist.html",
+        Listing.objects.filter(watchers__user=request.user).cards(), watch_badges=False)
 
 @login_required(login_url="/login")
 def add_or_delete_from_watchlist(request):
     #adds or removes a listing id from a user's watchlist
 
     try: # check if arguments are valid
-        listing_id = request.GET["listing_id"]
-        action = request.GET["action"]
+        listing_id = int(request.GET["listing_id"])
+        action = request.GET["action"].lower()
     except:
         return JsonResponse({"success":False, "error":"invalid argument(s)"})
 
-    # store the listing and clone the session watchlist for modification
-    listing = Listing.objects.filter(pk=listing_id,isActive=True)
-    watchlist = request.session["watchlist"]
-
-    # add or remove a listing or render an error 
-    if action.lower() == "add" and listing:
-        if listing[0].id not in watchlist:
-            watchlist.append(listing[0].id) 
-            request.session["watchlist"] = watchlist
+    # add or remove a listing or render an error, only active listings can be added
+    if action == "add" and Listing.objects.filter(pk=listing_id, isActive=True).exists():
+        WatchlistEntry.objects.get_or_create(user=request.user, listing_id=listing_id)
 
-    elif action.lower() == "delete" and listing:
-        watchlist.remove(listing[0].id)
-        request.session["watchlist"] = watchlist
+    elif action == "delete" and Listing.objects.filter(pk=listing_id).exists():
+        WatchlistEntry.objects.filter(user=request.user, listing_id=listing_id).delete()
     else:
         return JsonResponse({"success":False, "error":"invalid argument(s)"})
 
     return JsonResponse({"success":True})
 
-def in_watchlist(request):
+async def in_watchlist(request):
     """ check if a listing is a user's watchlist and returns a json response signifying"""
     try:
         listing_id = int(request.GET["listing_id"])
     except:
         return JsonResponse({"success":False, "error":"invalid argument"})
-    if request.user.is_authenticated:
-        is_in_watchlist = listing_id in request.session["watchlist"]
+
+    def load():
+        if not request.user.is_authenticated:
+            return None
+        return WatchlistEntry.objects.filter(user=request.user, listing_id=listing_id).exists()
+
+    is_in_watchlist = await in_thread(request, load)
+    if is_in_watchlist is not None:
         return JsonResponse({"in_watchlist": is_in_watchlist, "success":True}) 
     else:
         return JsonResponse({"success":False, "error":"user not logged in"})
 
+def watchlist_status(request):
+    """ tells which of the comma separated listing_ids are on the user's watchlist,
+    answered with a single query"""
+    try:
+        listing_ids = [int(pk) for pk in request.GET["listing_ids"].split(",")]
+    except:
+        return JsonResponse({"success":False, "error":"invalid argument"})
+    if len(listing_ids) > MAX_STATUS_IDS:
+        return JsonResponse({"success":False, "error":f"at most {MAX_STATUS_IDS} listing ids"})
+    if not request.user.is_authenticated:
+        return JsonResponse({"success":False, "error":"user not logged in"})
+
+    watched = WatchlistEntry.watchedAmong(request.user, listing_ids)
+    return JsonResponse({"success":True,
+        "in_watchlist":{pk:pk in watched for pk in listing_ids}})
+
+def listing_events(request, listing_id):
+    """ the live event stream is served by the asgi application, see streams.py.
+    under wsgi a 204 tells the browser's EventSource to stop trying"""
+    return HttpResponse(status=204)
+
+def card_cache_stats(request):
+    """ reports the listing card cache hit ratio of this process to staff"""
+    if not request.user.is_staff:
+        return JsonResponse({"success":False, "error":"staff only"}, status=403)
+    return JsonResponse(dict(fragments.stats(), success=True))
+
+def metrics_report(request):
+    """ the request metrics of this process in the prometheus text format, for
+    staff or a scraper holding METRICS_TOKEN"""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get("Authorization", "")
+    allowed = request.user.is_staff or (token and hmac.compare_digest(authorization, f"Bearer {token}"))
+    if not allowed:
+        return HttpResponse("staff only", status=403, content_type="text/plain")
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
+
 """ Authentication views """
 def login_view(request):
     if request.method == "POST":
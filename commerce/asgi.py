@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# imported once django is set up. the live listing streams bypass django's
+# request handling so they don't hold a worker thread each, and the handler
+# reads streamed exports off the event loop
+from auctions.streams import ASGIHandler, with_listing_events
+
+django_application = ASGIHandler()
+
+application = with_listing_events(django_application)
@@ -45,7 +45,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'auctions.middleware.StaticFilesMiddleware',
+    'auctions.metrics.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,19 +75,86 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'commerce.wsgi.application'
 
+# how the app is served, wsgi or asgi, see gunicorn.conf.py. under asgi the read
+# only views run on the event loop
+WEB_INTERFACE = config("WEB_INTERFACE", default="wsgi")
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# sqlite by default. DATABASE_ENGINE=postgresql switches to PostgreSQL, which
+# needs psycopg2 installed and is what to use once several gunicorn workers
+# write at once.
+DATABASE_ENGINE = config("DATABASE_ENGINE", default="sqlite3")
+
+if DATABASE_ENGINE == "postgresql":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config("DATABASE_NAME", default="commerce"),
+            'USER': config("DATABASE_USER", default=""),
+            'PASSWORD': config("DATABASE_PASSWORD", default=""),
+            'HOST': config("DATABASE_HOST", default=""),
+            'PORT': config("DATABASE_PORT", default=""),
+            # seconds a connection is kept for the next request of the same
+            # worker instead of reconnecting every time, 0 closes it each request.
+            # under ASGI a request's queries run on a thread of its own, whose
+            # connection nothing would reuse or close, so they are not kept there
+            'CONN_MAX_AGE': config("DATABASE_CONN_MAX_AGE", default=0 if WEB_INTERFACE == "asgi" else 60, cast=int),
+            # pooling is left to a pooler such as pgbouncer in front of the
+            # server. in transaction mode it can't keep server side cursors open
+            # between transactions, so set DATABASE_POOLED when using one
+            'DISABLE_SERVER_SIDE_CURSORS': config("DATABASE_POOLED", default=False, cast=bool),
+            'OPTIONS': {
+                'connect_timeout': config("DATABASE_CONNECT_TIMEOUT", default=5, cast=int),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config("DATABASE_NAME", default=os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                # seconds a write waits for another to finish before failing
+                # with "database is locked"
+                'timeout': config("SQLITE_BUSY_TIMEOUT", default=20, cast=float),
+            },
+        }
     }
+
+# set on every new sqlite connection, see auctions/db.py. in WAL mode readers
+# don't wait for the writer and synchronous=normal only syncs the log at
+# checkpoints, which can't corrupt the database. the journal mode is stored in
+# the database file, so it defaults to the rollback journal the checked in
+# db.sqlite3 has and every manage.py command leaves it be. gunicorn.conf.py
+# turns WAL on for the server, the journal has to be synced fully without it
+SQLITE_JOURNAL_MODE = config("SQLITE_JOURNAL_MODE", default="delete")
+
+SQLITE_PRAGMAS = {
+    'journal_mode': SQLITE_JOURNAL_MODE,
+    'synchronous': config("SQLITE_SYNCHRONOUS", default="normal" if SQLITE_JOURNAL_MODE == "wal" else "full"),
+    'mmap_size': config("SQLITE_MMAP_SIZE", default=256 * 1024 * 1024, cast=int),
 }
 
 AUTH_USER_MODEL = 'auctions.User'
 
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': config("CACHE_LOCATION", default="auctions"),
+    }
+}
+
+# the cache rendered listing cards, category counts and auction state versions
+# are kept in, see auctions/caching.py
+AUCTIONS_CACHE = config("AUCTIONS_CACHE", default="default")
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -126,4 +194,66 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 
-CRISPY_TEMPLATE_PACK = "bootstrap4"
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = "bootstrap4"
+
+# Sessions
+# https://docs.djangoproject.com/en/3.0/topics/http/sessions/
+
+# db keeps sessions in django_session. cached_db reads them from the cache and
+# only goes to the database when they aren't there, and writes go to both. It
+# needs a cache shared by every process (CACHE_BACKEND), or a session ended by
+# one is still found in another's cache, so auctions/checks.py refuses it on a
+# per-process cache. signed_cookies keeps sessions out of the server entirely,
+# the session is sent with each request instead.
+SESSION_ENGINE = config("SESSION_ENGINE", default="django.contrib.sessions.backends.db")
+
+SESSION_CACHE_ALIAS = config("SESSION_CACHE_ALIAS", default="default")
+
+
+# Listing feeds
+
+LISTINGS_PAGE_SIZE = config("LISTINGS_PAGE_SIZE", default=20, cast=int)
+
+SEARCH_RESULTS_LIMIT = config("SEARCH_RESULTS_LIMIT", default=50, cast=int)
+
+# comments rendered with a listing and fetched by each "load more"
+COMMENTS_PAGE_SIZE = config("COMMENTS_PAGE_SIZE", default=20, cast=int)
+
+
+# Bid ingestion, see auctions/ingest.py
+
+# "direct" writes each bid in its own request, "queue" hands bids to one
+# writer thread per process that commits whatever has queued up together
+BID_INGESTION = config("BID_INGESTION", default="direct")
+
+# most bids committed in one transaction
+BID_BATCH_SIZE = config("BID_BATCH_SIZE", default=100, cast=int)
+
+# seconds a request waits for its queued bid to be decided
+BID_QUEUE_TIMEOUT = config("BID_QUEUE_TIMEOUT", default=30, cast=float)
+
+
+# Auction state, see auctions/auction_state.py
+
+# most listings whose state each process keeps
+AUCTION_STATE_CACHE_SIZE = config("AUCTION_STATE_CACHE_SIZE", default=10000, cast=int)
+
+# how an entry changed by another process is noticed. with several processes use
+# auctions.auction_state.SharedCacheInvalidation and a shared AUCTIONS_CACHE
+AUCTION_STATE_INVALIDATION = config("AUCTION_STATE_INVALIDATION",
+    default="auctions.auction_state.LocalInvalidation")
+
+
+# Live listing updates, see auctions/streams.py
+
+AUCTIONS_PUBSUB_BACKEND = config("AUCTIONS_PUBSUB_BACKEND", default="auctions.pubsub.LocalBroker")
+
+# seconds between keepalive comments on an idle event stream
+EVENTS_KEEPALIVE = config("EVENTS_KEEPALIVE", default=15, cast=int)
+
+
+# Request metrics, see auctions/metrics.py
+
+# lets a scraper read /metrics with "Authorization: Bearer <token>", staff
+# can always read it
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
@@ -0,0 +1,19 @@
+""" gunicorn settings, read from the working directory on start
+
+WEB_INTERFACE=asgi serves commerce.asgi through uvicorn's worker instead of
+commerce.wsgi through gunicorn's own, see the Procfile. Each worker loads
+the auction state of the active listings before taking requests. SQLite is
+served in WAL mode unless SQLITE_JOURNAL_MODE says otherwise.
+"""
+import os
+
+if os.environ.get("WEB_INTERFACE") == "asgi":
+    worker_class = "uvicorn.workers.UvicornWorker"
+
+# read by the settings once the app is loaded, after this file
+os.environ.setdefault("SQLITE_JOURNAL_MODE", "wal")
+
+
+def post_worker_init(worker):
+    from auctions.auction_state import get_states
+    get_states().warm()